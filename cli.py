@@ -3,20 +3,65 @@
 import argparse
 from gis_to_swmm.run import run_model
 from gis_to_swmm.table import load_table  # ✅ Ensure this is imported
+from gis_to_swmm.grid import SLOPE_METHODS, REGION_MODES
+from gis_to_swmm.definitions import FLOWDIR_ENCODINGS
+from gis_to_swmm.io_utils import VECTOR_FORMATS, RASTER_FORMATS
+from gis_to_swmm.dissolve import ADAPTIVE_PRIORITIES
 
 def main():
     parser = argparse.ArgumentParser(description="Run GIS to SWMM model builder")
 
     # Required raster inputs
     parser.add_argument("dem", help="Path to DEM raster")
-    parser.add_argument("flowdir", help="Path to flow direction raster")
+    parser.add_argument("flowdir", help="Path to flow direction raster, or '-' to derive it from the DEM")
     parser.add_argument("landuse", help="Path to land use raster")
     parser.add_argument("output", help="Output directory for SWMM files")
 
     # Optional switches
     parser.add_argument("--dissolve-after-model", action="store_true", help="Run adaptive dissolve")
+    parser.add_argument("--dissolve-method", choices=("vector", "adaptive") + REGION_MODES, default="vector",
+                        help="Vector dissolve of cell polygons, adaptive merging of cell polygons towards "
+                             "the targets below, or label regions on the grid (by flow path and landuse, "
+                             "or by landuse and outlet) and polygonize them directly")
+    parser.add_argument("--max-subcatchments", type=int,
+                        help="Adaptive dissolve: merge until at most this many subcatchments remain")
+    parser.add_argument("--min-subcatchment-area", type=float,
+                        help="Adaptive dissolve: merge subcatchments smaller than this (m²)")
+    parser.add_argument("--max-subcatchment-area", type=float,
+                        help="Adaptive dissolve: never merge beyond this area (m²)")
+    parser.add_argument("--max-slope-std", type=float,
+                        help="Adaptive dissolve: largest standard deviation of slope (%%) within a subcatchment")
+    parser.add_argument("--merge-priority", choices=ADAPTIVE_PRIORITIES, default="area",
+                        help="Adaptive dissolve: merge the smallest or the most similar (mean slope) first")
+    parser.add_argument("--dissolve-workers", type=int, default=1,
+                        help="Threads (processes with --dissolve-tile) unioning groups in the vector dissolve")
+    parser.add_argument("--dissolve-tile", type=float, metavar="SIZE",
+                        help="Union the vector dissolve in square tiles of this size (CRS units), "
+                             "stitching groups across tile seams")
+    parser.add_argument("--slope-method", choices=SLOPE_METHODS, default="d8",
+                        help="Cell slope definition: D8 steepest descent, flow direction or Horn 3x3")
+    parser.add_argument("--flowdir-encoding", choices=sorted(FLOWDIR_ENCODINGS), default="grass",
+                        help="Flow direction raster codes: GRASS 1-8 (1=NE), TauDEM 1-8 (1=E) or ESRI 1-128")
+    parser.add_argument("--bounds", nargs=4, type=float, metavar=("LEFT", "BOTTOM", "RIGHT", "TOP"),
+                        help="Only read the rasters inside this bounding box")
+    parser.add_argument("--fill-sinks", action="store_true",
+                        help="Fill DEM depressions and resolve flats before routing")
+    parser.add_argument("--vector-format", choices=sorted(VECTOR_FORMATS) + ["none"], default="geojson",
+                        help="Format of the subcatchment, routing and dissolved layers, or 'none' to skip them")
+    parser.add_argument("--raster-format", choices=RASTER_FORMATS + ("none",), default="asc",
+                        help="Format of the per-cell raster outputs: ESRI ASCII, tiled compressed GeoTIFF, or none")
+    parser.add_argument("--raster-precision", type=int, default=3,
+                        help="Decimals written for float layers in ESRI ASCII output")
+    parser.add_argument("--scratch-dir", help="Back raster arrays with memory-mapped files in this directory")
+    parser.add_argument("--junction-landuse", nargs="+", type=int,
+                        help="Only cells with these landuse codes connect to junctions (e.g. 10 for roofs)")
+    parser.add_argument("--junction-max-distance", type=float,
+                        help="Maximum distance from a cell center to its junction")
 
     # Optional SWMM input tables
+    parser.add_argument("--base-inp",
+                        help="Existing .inp model to patch: only the subcatchment sections (and any tables "
+                             "given below) are rewritten, all other sections are copied as they are")
     parser.add_argument("--junctions", help="CSV file of junctions")
     parser.add_argument("--conduits", help="CSV file of conduits")
     parser.add_argument("--header", help="CSV for OPTIONS block")
@@ -41,17 +86,36 @@ def main():
     args = parser.parse_args()
 
     # ✅ Correct loader function for optional tables
-    def load(path):
-        return load_table(path) if path else None
+    def load(path, section=None):
+        return load_table(path, section) if path else None
 
     run_model(
         dem_path=args.dem,
-        flowdir_path=args.flowdir,
+        flowdir_path=None if args.flowdir == "-" else args.flowdir,
         landuse_path=args.landuse,
         output_dir=args.output,
         run_dissolve=args.dissolve_after_model,
-        junctions=load(args.junctions),
-        conduits=load(args.conduits),
+        dissolve_method=args.dissolve_method,
+        dissolve_workers=args.dissolve_workers,
+        dissolve_tile=args.dissolve_tile,
+        max_subcatchments=args.max_subcatchments,
+        min_subcatchment_area=args.min_subcatchment_area,
+        max_subcatchment_area=args.max_subcatchment_area,
+        max_slope_std=args.max_slope_std,
+        merge_priority=args.merge_priority,
+        slope_method=args.slope_method,
+        flowdir_encoding=args.flowdir_encoding,
+        bounds=args.bounds,
+        scratch_dir=args.scratch_dir,
+        junction_landuse=args.junction_landuse,
+        junction_max_distance=args.junction_max_distance,
+        fill_sinks=args.fill_sinks,
+        vector_format=None if args.vector_format == "none" else args.vector_format,
+        raster_format=None if args.raster_format == "none" else args.raster_format,
+        raster_precision=args.raster_precision,
+        base_inp=args.base_inp,
+        junctions=load(args.junctions, "junctions"),
+        conduits=load(args.conduits, "conduits"),
         header=load(args.header),
         catchment_props=load(args.catchment_props),
         evaporation=load(args.evaporation),
@@ -95,4 +159,8 @@ if __name__ == "__main__":
 #   --input data/subcatchs_trial.shp \
 #   --output outputs/merged.gpkg \
 #   --tile 500
+#
+## the model run dissolves in tiles with
+# python cli.py dem.tif flowdir.tif landuse.tif outputs/demo \
+#   --dissolve-after-model --dissolve-tile 500 --dissolve-workers 8
 
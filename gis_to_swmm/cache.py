@@ -0,0 +1,68 @@
+# cache.py
+#
+# On-disk cache for derived inputs (resampled rasters, parsed tables).
+# Entries live under $GIS_TO_SWMM_CACHE, or ~/.cache/gis-to-swmm, and are
+# named by a hash of everything that determines their content. Caching is
+# opt-in: callers only use it by default when $GIS_TO_SWMM_CACHE is set.
+
+import hashlib
+import os
+
+CACHE_ENV = "GIS_TO_SWMM_CACHE"
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def cache_dir() -> str:
+    path = os.environ.get(CACHE_ENV) or os.path.join(os.path.expanduser("~"), ".cache", "gis-to-swmm")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_configured() -> bool:
+    """True when the user has pointed GIS_TO_SWMM_CACHE at a cache directory."""
+    return bool(os.environ.get(CACHE_ENV))
+
+
+def cache_path(namespace: str, key: str, suffix: str = "") -> str:
+    """Path of a cache entry; the namespace directory is created on demand."""
+    directory = os.path.join(cache_dir(), namespace)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, key + suffix)
+
+
+def digest(*parts) -> str:
+    """Stable hash of the repr of the given parts."""
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's content, read in blocks."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def stat_digest(path: str) -> str:
+    """
+    file_digest of path, remembered under the file's absolute path, size
+    and modification time so an unchanged file is hashed only once.
+    """
+    stat = os.stat(path)
+    entry = cache_path("digests", digest(os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    if os.path.exists(entry):
+        with open(entry) as f:
+            return f.read()
+
+    value = file_digest(path)
+    tmp = entry + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(value)
+    publish(tmp, entry)
+    return value
+
+
+def publish(tmp_path: str, path: str):
+    """Move a fully written temporary file into place atomically."""
+    os.replace(tmp_path, path)
@@ -42,7 +42,7 @@ class Cell:
     neighbor_distances: List[float] = field(default_factory=lambda: [0.0] * 8)
     
     outlet: str = "*"                         # name of the outlet node or subcatchment
-    outlet_id: int = -1                       # index of the outlet (cell or junction)
+    outlet_id: int = -1                       # node id of the outlet (cell, junction or outfall)
     outlet_coord: Tuple[float, float] = (0.0, 0.0)  # coordinates of the outlet
     is_sink: int = 0              # 0=routed, 1=sink, 2=forced (e.g., roof to junction)
 
@@ -8,6 +8,18 @@ LANDUSE = {
     "LANDUSE_NONE": 0
 }
 
+# Parameter columns of subcatchment layers (cell exports and external layers), by the Cell field they fill
+LAYER_PARAM_COLUMNS = {
+    "imp_pct": "imperv",
+    "n_imp": "N_Imperv",
+    "n_per": "N_Perv",
+    "S_imp_mm": "S_Imperv",
+    "S_per_mm": "S_Perv",
+    "suct_mm": "Suction",
+    "Ksat_mmhr": "HydCon",
+    "IMDmax": "IMDmax",
+}
+
 class Junction:
     def __init__(self, name, x, y, is_open=True, invert_elev=0.0):
         self.name = name
@@ -24,3 +36,30 @@ class Conduit:
         self.length = length
         self.roughness = roughness
 
+
+# D8 neighbor offsets (row, col). A cell's flow direction is stored as
+# an index into this list.
+D8_OFFSETS = [
+    (-1, 1),  # NE
+    (-1, 0),  # N
+    (-1, -1), # NW
+    (0, -1),  # W
+    (1, -1),  # SW
+    (1, 0),   # S
+    (1, 1),   # SE
+    (0, 1),   # E
+]
+
+# D8 flow direction encodings: raster code -> (row offset, col offset).
+# "grass" is the r.watershed drainage ordering (1 = NE, counterclockwise),
+# which is also the ordering the model has always assumed. Codes missing
+# from a table (nodata, GRASS negative "leaves region" codes, 0 for pits)
+# decode to no downstream cell.
+FLOWDIR_ENCODINGS = {
+    "grass": {1: (-1, 1), 2: (-1, 0), 3: (-1, -1), 4: (0, -1),
+              5: (1, -1), 6: (1, 0), 7: (1, 1), 8: (0, 1)},
+    "taudem": {1: (0, 1), 2: (-1, 1), 3: (-1, 0), 4: (-1, -1),
+               5: (0, -1), 6: (1, -1), 7: (1, 0), 8: (1, 1)},
+    "esri": {1: (0, 1), 2: (1, 1), 4: (1, 0), 8: (1, -1),
+             16: (0, -1), 32: (-1, -1), 64: (-1, 0), 128: (-1, 1)},
+}
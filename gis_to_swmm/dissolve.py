@@ -1,9 +1,28 @@
+import heapq
+import time
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-import networkx as nx
-from shapely.geometry import Polygon
-from shapely.ops import unary_union
-from typing import List, Dict
+import shapely
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from rasterio import features
+from rasterio.transform import Affine
+from typing import List, Optional
+from gis_to_swmm import hydrology
+from gis_to_swmm.io_utils import read_layer, write_layer
+
+# Ways of unioning the member polygons of each dissolved group: "raster"
+# labels aligned grid squares and polygonizes the labels, "coverage" merges
+# polygons that only share edges, "unary" is the general union and "auto"
+# picks "raster" for grid squares and "unary" otherwise
+UNION_METHODS = ("auto", "raster", "coverage", "unary")
+
+# Groups unioned per task by the parallel union
+UNION_BATCH_GROUPS = 1_000
+
+# Merge order of the adaptive dissolve: smallest merged area first, or the
+# neighbors with the most similar mean slope first
+ADAPTIVE_PRIORITIES = ("area", "slope")
 
 COLUMNS = [
     "name", "flowzone", "landuse", "outlet",
@@ -12,118 +31,503 @@ COLUMNS = [
     "isSink", "Tag", "geometry"
 ]
 
-def build_flow_graph(flowlines_gdf):
-    G = nx.DiGraph()
-    for _, row in flowlines_gdf.iterrows():
-        from_cell = row["from"]
-        to_cell = row["to"]
-        G.add_edge(from_cell, to_cell)
-    return G
-
-def merge_cells(cell_a, cell_b):
-    area_a = cell_a["area_m2"]
-    area_b = cell_b["area_m2"]
-    total_area = area_a + area_b
-
-    elev = (cell_a["elevation"] * area_a + cell_b["elevation"] * area_b) / total_area
-    slope = (cell_a["slope_pct"] * area_a + cell_b["slope_pct"] * area_b) / total_area
-    geom = unary_union([cell_a["geometry"], cell_b["geometry"]])
-
-    return {
-        "name": cell_a["name"],
-        "flowzone": cell_a.get("flowzone", 0),
-        "landuse": cell_a["landuse"],
-        "outlet": cell_a["outlet"],
-        "area_m2": total_area,
-        "slope_pct": slope,
-        "elevation": elev,
-        "imp_pct": cell_a.get("imp_pct", 0),
-        "n_imp": cell_a.get("n_imp", 0),
-        "n_per": cell_a.get("n_per", 0),
-        "S_imp_mm": cell_a.get("S_imp_mm", 0),
-        "S_per_mm": cell_a.get("S_per_mm", 0),
-        "suct_mm": cell_a.get("suct_mm", 0),
-        "Ksat_mmhr": cell_a.get("Ksat_mmhr", 0),
-        "IMDmax": cell_a.get("IMDmax", 0),
-        "isSink": cell_a.get("isSink", False),
-        "Tag": cell_a.get("Tag", ""),
-        "geometry": geom
-    }
-
-def dissolve_subcatchments_geojson(subcatchment_file, flowline_file, output_file):
+def flow_index(names: pd.Series, flowlines: pd.DataFrame) -> np.ndarray:
+    """
+    Row of the subcatchment each subcatchment drains to, or -1 when its
+    flowline ends somewhere that is not a subcatchment (a junction, say) or
+    it has no flowline, and a mask of the rows on any flowline. Names are
+    looked up once through a name -> row index; repeated names resolve to
+    their first row.
+    """
+    rows = np.flatnonzero(~names.duplicated().to_numpy())
+    lookup = pd.Index(names.to_numpy()[rows])
+    source = lookup.get_indexer(flowlines["from"])
+    target = lookup.get_indexer(flowlines["to"])
+    first = ~pd.Index(source).duplicated() & (source >= 0)
+
+    downstream = np.full(len(names), -1, dtype=np.int64)
+    has_target = first & (target >= 0)
+    downstream[rows[source[has_target]]] = rows[target[has_target]]
+
+    in_graph = np.zeros(len(names), dtype=bool)
+    in_graph[rows[source[source >= 0]]] = True
+    in_graph[rows[target[target >= 0]]] = True
+    return downstream, in_graph
+
+def dissolve_groups(names, outlet, landuse, downstream, in_graph):
+    """
+    Group the subcatchments after the flow-aware dissolve rule in a single
+    reverse-topological pass over integer arrays.
+
+    Walking downstream first, a subcatchment not yet taken starts a seed and
+    takes the subcatchments draining into it; those with the seed's landuse
+    are merged into it, the others stay as they are. The resulting records
+    are then grouped by the outlet and landuse of their seed.
+
+    Returns the record (root row) of every row, -1 for rows outside the
+    flow graph, and the number of merges.
+    """
+    n = len(names)
+    levels = hydrology.topological_levels(downstream)
+    cut = hydrology.cycle_outlets(downstream, levels)
+    if cut.size:
+        # Without a way out, cycles and everything draining into them would be lost
+        print(f"⚠️ Outlets form {cut.size} cycles; their first subcatchments become seeds")
+        downstream = downstream.copy()
+        downstream[cut] = -1
+        levels = hydrology.topological_levels(downstream)
+
+    # A row is taken when the subcatchment it drains to is a seed
+    seed = in_graph.copy()
+    for level in reversed(levels):
+        target = downstream[level]
+        routed = target >= 0
+        seed[level[routed]] = ~seed[target[routed]]
+
+    # Union of each taken row with its seed when the landuse matches
+    root = np.where(in_graph, np.arange(n), -1)
+    taken = in_graph & ~seed & (downstream >= 0)
+    target = downstream[taken]
+    merge = (landuse[taken] == landuse[target]) & (outlet[taken] == names[target])
+    root[np.flatnonzero(taken)[merge]] = target[merge]
+    return root, int(merge.sum())
+
+def grid_squares(geometry: np.ndarray, tol: float = 1e-6):
+    """
+    Placement of polygons that are equal axis-aligned rectangles on one
+    lattice, such as the cell layers: (rows, cols, transform) of a label
+    grid holding one polygon per pixel, or None for any other input.
+    """
+    if not geometry.size or (shapely.get_num_coordinates(geometry) != 5).any():
+        return None
+    bounds = shapely.bounds(geometry)
+    width, height = bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1]
+    w, h = width[0], height[0]
+    if w <= 0 or h <= 0 or np.ptp(width) > tol * w or np.ptp(height) > tol * h:
+        return None
+    if np.abs(shapely.area(geometry) - w * h).max() > tol * w * h:
+        return None
+
+    x0, y1 = bounds[:, 0].min(), bounds[:, 3].max()
+    cols, rows = (bounds[:, 0] - x0) / w, (y1 - bounds[:, 3]) / h
+    if np.abs(cols - np.rint(cols)).max() > tol or np.abs(rows - np.rint(rows)).max() > tol:
+        return None
+    rows, cols = np.rint(rows).astype(np.int64), np.rint(cols).astype(np.int64)
+    if np.unique(rows * (cols.max() + 1) + cols).size != geometry.size:
+        return None
+    return rows, cols, Affine(w, 0, x0, 0, -h, y1)
+
+def _union_batch(parts: List[np.ndarray], method: str) -> List:
+    union = shapely.coverage_union_all if method == "coverage" else shapely.union_all
+    return [union(p) for p in parts]
+
+def union_groups(geometry: np.ndarray, group: np.ndarray, n: int,
+                 method: str = "auto", workers: int = 1) -> np.ndarray:
+    """
+    One union of the member polygons of every group 0..n-1, done once per
+    group after grouping (see UNION_METHODS). With workers > 1 batches of
+    groups are unioned on a thread pool; shapely releases the GIL.
+    """
+    if method not in UNION_METHODS:
+        raise ValueError(f"Unknown union method '{method}', expected one of {UNION_METHODS}")
+
+    if method in ("auto", "raster"):
+        placement = grid_squares(geometry)
+        if placement is not None:
+            rows, cols, transform = placement
+            labels = np.full((rows.max() + 1, cols.max() + 1), -1, dtype=np.int64)
+            labels[rows, cols] = group
+            return polygonize_labels(labels, transform, n)
+        if method == "raster":
+            raise ValueError("Raster union needs equal, grid-aligned square polygons")
+        method = "unary"
+
+    order = np.argsort(group, kind="stable")
+    parts = np.split(geometry[order], np.cumsum(np.bincount(group, minlength=n))[:-1])
+    batches = [parts[i:i + UNION_BATCH_GROUPS] for i in range(0, n, UNION_BATCH_GROUPS)]
+    if workers > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(workers) as pool:
+            unions = pool.map(_union_batch, batches, [method] * len(batches))
+    else:
+        unions = (_union_batch(batch, method) for batch in batches)
+
+    geometry = np.empty(n, dtype=object)
+    geometry[:] = [g for batch in unions for g in batch]
+    return geometry
+
+def _union_tile(wkb: np.ndarray, group: np.ndarray, n: int, method: str) -> np.ndarray:
+    # Runs in a worker process; geometries travel as WKB
+    return shapely.to_wkb(union_groups(shapely.from_wkb(wkb), group, n, method))
+
+def tile_index(geometry: np.ndarray, tile: float) -> np.ndarray:
+    """Tile number 0..k-1 of every polygon, from the square tile holding its bounding-box center."""
+    bounds = shapely.bounds(geometry)
+    x = np.floor(((bounds[:, 0] + bounds[:, 2]) / 2 - bounds[:, 0].min()) / tile).astype(np.int64)
+    y = np.floor(((bounds[:, 1] + bounds[:, 3]) / 2 - bounds[:, 1].min()) / tile).astype(np.int64)
+    return pd.factorize(y * (x.max() + 1) + x)[0]
+
+def union_groups_tiled(geometry: np.ndarray, group: np.ndarray, n: int, tile: float,
+                       method: str = "auto", workers: int = 1) -> np.ndarray:
+    """
+    union_groups over square tiles of the given size (in CRS units). Every
+    tile unions its polygons per group in a process pool; groups that cross
+    a tile seam come back as one piece per tile and are stitched with one
+    more union of their pieces. The polygons match the untiled union.
+    """
+    if not geometry.size:
+        return np.empty(n, dtype=object)
+    tiles = tile_index(geometry, tile)
+    print(f"⚙ Processing {tiles.max() + 1} tiles of {tile:g} units...")
+    order = np.argsort(tiles, kind="stable")
+    jobs, tile_groups = [], []
+    for members in np.split(order, np.cumsum(np.bincount(tiles))[:-1]):
+        local, groups = pd.factorize(group[members])
+        jobs.append((shapely.to_wkb(geometry[members]), local, len(groups), method))
+        tile_groups.append(groups)
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_union_tile, *zip(*jobs)))
+    else:
+        results = [_union_tile(*job) for job in jobs]
+
+    pieces = shapely.from_wkb(np.concatenate(results))
+    piece_group = np.concatenate(tile_groups)
+    geometry = np.empty(n, dtype=object)
+    single = np.bincount(piece_group, minlength=n)[piece_group] == 1
+    geometry[piece_group[single]] = pieces[single]
+
+    # Seam stitching: pieces of one group are disjoint, so they form a coverage
+    if (~single).any():
+        crossing, local = np.unique(piece_group[~single], return_inverse=True)
+        stitch = "coverage" if method == "coverage" else "unary"
+        geometry[crossing] = union_groups(pieces[~single], local, crossing.size, stitch, workers)
+    return geometry
+
+def dissolve_geometry(geometry: np.ndarray, group: np.ndarray, n: int, union: str = "auto",
+                      workers: int = 1, tile: Optional[float] = None) -> np.ndarray:
+    """union_groups, or union_groups_tiled when a tile size is given."""
+    if tile:
+        return union_groups_tiled(geometry, group, n, tile, union, workers)
+    print("⚙ Processing entire dataset without tiling...")
+    return union_groups(geometry, group, n, union, workers)
+
+def dissolve_subcatchments(subcatchments, flowlines, output_file=None, union: str = "auto",
+                           workers: int = 1, tile: Optional[float] = None) -> gpd.GeoDataFrame:
+    """
+    Dissolve cells along the flow graph. subcatchments and flowlines are
+    GeoDataFrames or paths in any format read_layer accepts; the result is
+    returned and also written to output_file when one is given. Members are
+    collected per group and unioned once per group (see union_groups), over
+    tiles of the given size on worker processes when tile is set.
+    """
     print("📥 Reading subcatchments and flowlines...")
-    sub_gdf = gpd.read_file(subcatchment_file)
-    sub_gdf["name"] = sub_gdf["name"].astype(str).str.strip()
-    flow_gdf = gpd.read_file(flowline_file)
-    flow_gdf["from"] = flow_gdf["from"].astype(str).str.strip()
-    flow_gdf["to"] = flow_gdf["to"].astype(str).str.strip()
-
-    G = build_flow_graph(flow_gdf)
-    processed = set()
-    new_subcatchments: Dict[str, Dict] = {}
-    roof_subcatchments: List[Dict] = []
-    merge_count = 0
+    sub_gdf = read_layer(subcatchments)
+    flow_gdf = read_layer(flowlines)
+    names = sub_gdf["name"].astype(str).str.strip()
+    flows = pd.DataFrame({
+        "from": flow_gdf["from"].astype(str).str.strip(),
+        "to": flow_gdf["to"].astype(str).str.strip(),
+    })
 
     print("🧭 Starting topological traversal...")
-    sub_names = set(sub_gdf["name"])
-
-    for node in reversed(list(nx.topological_sort(G))):
-        if node not in sub_names or node in processed:
-            continue
-
-        match = sub_gdf[sub_gdf["name"] == node]
-        if match.empty:
-            continue
-
-        current = match.iloc[0]
-        current_sub = current.to_dict()
-
-        upstreams = list(G.predecessors(node))
-        for up in upstreams:
-            if up not in sub_names:
-                continue
-            if up in new_subcatchments:
-                upstream = new_subcatchments[up]
-            else:
-                up_match = sub_gdf[sub_gdf["name"] == up]
-                if up_match.empty:
-                    continue
-                upstream = up_match.iloc[0].to_dict()
-
-            if upstream["landuse"] == current_sub["landuse"] and upstream["outlet"] == current_sub["name"]:
-                current_sub = merge_cells(current_sub, upstream)
-                merge_count += 1
-            else:
-                new_subcatchments[up] = upstream
-
-            processed.add(up)
-
-        processed.add(node)
-        new_subcatchments[node] = current_sub
-
+    names_array = names.to_numpy(dtype=object)
+    downstream, in_graph = flow_index(names, flows)
+    root, merge_count = dissolve_groups(
+        names_array, sub_gdf["outlet"].to_numpy(dtype=object), sub_gdf["landuse"].to_numpy(),
+        downstream, in_graph
+    )
     print(f"🔁 Total merges performed: {merge_count}")
     print("📊 Grouping dissolved subcatchments by outlet and landuse...")
 
-    merged = pd.DataFrame(list(new_subcatchments.values()))
-    merged_gdf = gpd.GeoDataFrame(merged, geometry='geometry', crs=sub_gdf.crs)
+    # Records: area sum and area-weighted means over their members
+    rows = np.flatnonzero(root >= 0)
+    record, record_root = pd.factorize(root[rows])
+    area = sub_gdf["area_m2"].to_numpy(dtype=float)[rows]
+    record_area = np.bincount(record, weights=area)
+
+    def record_mean(column):
+        values = sub_gdf[column].to_numpy(dtype=float)[rows]
+        return np.bincount(record, weights=area * values) / record_area
+
+    records = pd.DataFrame({
+        "outlet": sub_gdf["outlet"].to_numpy()[record_root],
+        "landuse": sub_gdf["landuse"].to_numpy()[record_root],
+        "area_m2": record_area,
+        "slope_pct": record_mean("slope_pct"),
+        "elevation": record_mean("elevation"),
+    })
+
+    # Groups: records sharing outlet and landuse, one union of the member cells each
+    group = records.groupby(["outlet", "landuse"], sort=True).ngroup().to_numpy()
+    aggregated = records.groupby(group).agg(
+        outlet=("outlet", "first"), landuse=("landuse", "first"),
+        area_m2=("area_m2", "sum"), slope_pct=("slope_pct", "mean"), elevation=("elevation", "mean"),
+    )
+    geometry = dissolve_geometry(sub_gdf.geometry.to_numpy()[rows], group[record], len(aggregated),
+                                 union, workers, tile)
+    grouped = gpd.GeoDataFrame({
+        "outlet": aggregated["outlet"].to_numpy(),
+        "landuse": aggregated["landuse"].to_numpy(),
+        "geometry": geometry,
+        "area_m2": aggregated["area_m2"].to_numpy(),
+        "slope_pct": aggregated["slope_pct"].to_numpy(),
+        "elevation": aggregated["elevation"].to_numpy(),
+    }, geometry="geometry", crs=sub_gdf.crs)
+
+    if output_file:
+        print("💾 Writing final output...")
+        write_layer(output_file, grouped)
+        print(f"✅ Output saved to {output_file}")
+    return grouped
+
+def adaptive_dissolve(
+    subcatchments, flowlines, output_file=None,
+    max_count: Optional[int] = None, min_area: Optional[float] = None,
+    max_area: Optional[float] = None, max_slope_std: Optional[float] = None,
+    same_landuse: bool = True, priority: str = "area",
+    union: str = "auto", workers: int = 1, tile: Optional[float] = None
+) -> gpd.GeoDataFrame:
+    """
+    Merge flow-connected subcatchments until there are at most max_count
+    of them and none is smaller than min_area (m²). A subcatchment only
+    merges into the one it drains to, so every result still has a single
+    outlet. Merges must keep the landuse (unless same_landuse is False),
+    stay within max_area and keep the area-weighted standard deviation of
+    slope_pct within max_slope_std. Without targets, everything allowed is
+    merged; if the limits stop merging short of the targets, a warning
+    gives the count and smallest area reached.
+
+    Candidate merges wait in a priority queue (see ADAPTIVE_PRIORITIES)
+    keyed by region and version; entries whose neighbor changed since they
+    were queued are re-evaluated when popped. Region attributes are kept as
+    running sums, so no layer is re-read. Each iteration merges every region
+    at most once and logs its time and polygon count.
+    """
+    if priority not in ADAPTIVE_PRIORITIES:
+        raise ValueError(f"Unknown merge priority '{priority}', expected one of {ADAPTIVE_PRIORITIES}")
 
-    grouped = merged_gdf.dissolve(by=["outlet", "landuse"], aggfunc={
-        "area_m2": "sum",
-        "slope_pct": "mean",
-        "elevation": "mean"
-    }).reset_index()
+    print("📥 Reading subcatchments and flowlines...")
+    sub_gdf = read_layer(subcatchments)
+    flow_gdf = read_layer(flowlines)
+    names = sub_gdf["name"].astype(str).str.strip()
+    flows = pd.DataFrame({
+        "from": flow_gdf["from"].astype(str).str.strip(),
+        "to": flow_gdf["to"].astype(str).str.strip(),
+    })
+    downstream, _ = flow_index(names, flows)
+    unique = ~names.duplicated().to_numpy()
+
+    area = sub_gdf["area_m2"].to_numpy(dtype=float)
+    slope = sub_gdf["slope_pct"].to_numpy(dtype=float)
+    landuse = sub_gdf["landuse"].to_numpy()
+
+    # Region state, indexed by the region's root row
+    parent = list(range(len(sub_gdf)))
+    version = [0] * len(sub_gdf)
+    region_area = area.tolist()
+    slope_sum = (area * slope).tolist()
+    slope_sq_sum = (area * slope ** 2).tolist()
+    region_landuse = landuse.tolist()
+    exit_target = downstream.tolist()
+    count = int(unique.sum())
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def candidate(r):
+        """Queue entry for merging region r into the region it drains to, or None."""
+        if exit_target[r] < 0:
+            return None
+        d = find(exit_target[r])
+        if d == r or (same_landuse and region_landuse[r] != region_landuse[d]):
+            return None
+        merged = region_area[r] + region_area[d]
+        if max_area is not None and merged > max_area:
+            return None
+        if max_slope_std is not None:
+            mean = (slope_sum[r] + slope_sum[d]) / merged
+            variance = (slope_sq_sum[r] + slope_sq_sum[d]) / merged - mean ** 2
+            if np.sqrt(max(variance, 0.0)) > max_slope_std:
+                return None
+        if priority == "area":
+            key = merged
+        else:
+            key = abs(slope_sum[r] / region_area[r] - slope_sum[d] / region_area[d])
+        return (key, r, version[r], d, version[d])
+
+    def needed(r, d):
+        if max_count is None and min_area is None:
+            return True
+        if max_count is not None and count > max_count:
+            return True
+        return min_area is not None and min(region_area[r], region_area[d]) < min_area
+
+    heap = [entry for entry in map(candidate, np.flatnonzero(unique).tolist()) if entry]
+    heapq.heapify(heap)
+
+    iteration = 0
+    while heap:
+        iteration += 1
+        start = time.perf_counter()
+        print(f"🌀 Iteration {iteration} — {count} polygons")
+        merged_this, deferred, merges = set(), [], 0
+
+        while heap:
+            entry = heapq.heappop(heap)
+            _, r, r_version, d, d_version = entry
+            if parent[r] != r or version[r] != r_version:
+                continue
+            if parent[d] != d or version[d] != d_version:
+                # The downstream region changed since this entry was queued
+                entry = candidate(r)
+                if entry:
+                    heapq.heappush(heap, entry)
+                continue
+            if r in merged_this or d in merged_this:
+                deferred.append(entry)
+                continue
+            if not needed(r, d):
+                continue
 
-    print("💾 Writing final output...")
-    grouped.to_file(output_file, driver="GeoJSON")
-    print(f"✅ Output saved to {output_file}")
+            parent[r] = d
+            region_area[d] += region_area[r]
+            slope_sum[d] += slope_sum[r]
+            slope_sq_sum[d] += slope_sq_sum[r]
+            version[r] += 1
+            version[d] += 1
+            count -= 1
+            merges += 1
+            merged_this.update((r, d))
+
+            entry = candidate(d)
+            if entry:
+                heapq.heappush(heap, entry)
+
+        print(f"   merged {merges} pairs in {time.perf_counter() - start:.2f}s, {count} polygons left")
+        if not merges:
+            break
+        heap = deferred
+        heapq.heapify(heap)
+
+    # Regions: area-weighted attributes reduced once from the member rows
+    rows = np.flatnonzero(unique)
+    roots = np.array([find(i) for i in rows.tolist()], dtype=np.int64)
+    region, region_root = pd.factorize(roots)
+    n = len(region_root)
+    total = np.bincount(region, weights=area[rows], minlength=n)
+
+    def weighted(values):
+        return np.bincount(region, weights=area[rows] * values[rows], minlength=n) / total
+
+    mean_slope = weighted(slope)
+    region_of_row = np.full(len(sub_gdf), -1, dtype=np.int64)
+    region_of_row[rows] = region
+
+    # A region drains to the region holding its exit target, or to its root's outlet
+    names_array = names.to_numpy(dtype=object)
+    target = downstream[region_root]
+    outlet = sub_gdf["outlet"].to_numpy(dtype=object)[region_root].copy()
+    into_region = target >= 0
+    outlet[into_region] = names_array[region_root[region_of_row[target[into_region]]]]
+
+    geometry = dissolve_geometry(sub_gdf.geometry.to_numpy()[rows], region, n, union, workers, tile)
+    dissolved = gpd.GeoDataFrame({
+        "name": names_array[region_root],
+        "outlet": outlet,
+        "landuse": landuse[region_root],
+        "geometry": geometry,
+        "area_m2": total,
+        "slope_pct": mean_slope,
+        "slope_std": np.sqrt(np.maximum(weighted(slope ** 2) - mean_slope ** 2, 0.0)),
+        "elevation": weighted(sub_gdf["elevation"].to_numpy(dtype=float)),
+        "cells": np.bincount(region, minlength=n),
+    }, geometry="geometry", crs=sub_gdf.crs)
+    print(f"✅ Adaptive dissolve: {len(rows)} → {n} polygons in {iteration} iterations")
+    smallest = total.min() if n else 0.0
+    if (max_count is not None and n > max_count) or (min_area is not None and smallest < min_area):
+        print(f"⚠️ No further merges allowed: {n} polygons (target at most {max_count}), "
+              f"smallest {smallest:.1f} m² (target at least {min_area})")
+
+    if output_file:
+        print("💾 Writing final output...")
+        write_layer(output_file, dissolved)
+        print(f"✅ Output saved to {output_file}")
+    return dissolved
+
+def dissolve_subcatchments_geojson(subcatchment_file, flowline_file, output_file):
+    return dissolve_subcatchments(subcatchment_file, flowline_file, output_file)
+
+def polygonize_labels(labels: np.ndarray, transform, n: int) -> np.ndarray:
+    """
+    Trace the outline of every label once with rasterio's shapes routine
+    and return one geometry per label 0..n-1. A label made of several
+    pieces (joined only diagonally, say) becomes a MultiPolygon.
+    """
+    # Gather every ring's vertices, then build all rings and polygons in bulk
+    coords, ring_sizes, rings_per_part, values = [], [], [], []
+    for geom, value in features.shapes(labels.astype(np.int32), mask=labels >= 0, transform=transform):
+        rings = geom["coordinates"]
+        for ring in rings:
+            coords.extend(ring)
+            ring_sizes.append(len(ring))
+        rings_per_part.append(len(rings))
+        values.append(int(value))
+
+    values = np.array(values, dtype=np.int64)
+    if not values.size:
+        return np.empty(n, dtype=object)
+    rings = shapely.linearrings(
+        np.array(coords, dtype=float), indices=np.repeat(np.arange(len(ring_sizes)), ring_sizes))
+    parts = shapely.polygons(rings, indices=np.repeat(np.arange(values.size), rings_per_part))
+
+    order = np.argsort(values, kind="stable")
+    parts, values = parts[order], values[order]
+
+    geometry = np.empty(n, dtype=object)
+    counts = np.bincount(values, minlength=n)
+    single = counts[values] == 1
+    geometry[values[single]] = parts[single]
+    if (~single).any():
+        multi = np.unique(values[~single])
+        geometry[multi] = shapely.multipolygons(parts[~single], indices=np.searchsorted(multi, values[~single]))
+    return geometry
+
+def dissolve_raster(grid, by: str = "flow", output_file=None) -> gpd.GeoDataFrame:
+    """
+    Dissolve in the raster domain: label the grid into regions (see
+    Grid.region_labels), reduce the cell attributes per label and
+    polygonize each label once. No per-cell geometry is ever built.
+
+    The result carries the subcatchment columns of Grid.region_frame plus
+    the area_m2/slope_pct/elevation layer columns, so it can be written as
+    a layer and passed to save_swmm_inp as is.
+    """
+    print(f"🧩 Labelling regions by {by}...")
+    labels = grid.region_labels(by)
+    regions = grid.region_frame(labels)
+    print(f"🔷 Polygonizing {len(regions)} regions...")
+    geometry = polygonize_labels(labels, grid.transform, len(regions))
+
+    regions["area_m2"] = regions["area"]
+    regions["slope_pct"] = regions["slope"] * 100
+    dissolved = gpd.GeoDataFrame(regions, geometry=geometry, crs=grid.crs or None)
+
+    if output_file:
+        write_layer(output_file, dissolved)
+        print(f"✅ Output saved to {output_file}")
+    return dissolved
 
 
 # import geopandas as gpd
 # import pandas as pd
-# import networkx as nx
-# from shapely.geometry import Polygon
-# from shapely.ops import unary_union
-# from typing import List
+# # from shapely.geometry import Polygon
+# # from typing import List
 
 # COLUMNS = [
 #     "name", "flowzone", "landuse", "outlet",
@@ -1,184 +1,878 @@
 # grid.py
 
-from gis_to_swmm import cell
 import numpy as np
+import pandas as pd
+from dataclasses import fields
 from gis_to_swmm.cell import Cell
-from gis_to_swmm.definitions import LANDUSE, Junction, Conduit
+from gis_to_swmm.definitions import LANDUSE, D8_OFFSETS, FLOWDIR_ENCODINGS, Junction, Conduit
 from gis_to_swmm.raster import Raster
-from shapely.geometry import Point
-from shapely.ops import nearest_points
+from gis_to_swmm import hydrology
+import shapely
 from shapely.strtree import STRtree
-from typing import List
-import math
+from typing import Iterable, List, Optional
+
+# Subcatchment parameters that depend only on the landuse class. They are
+# stored once per landuse code instead of once per cell.
+LANDUSE_PARAMS = [
+    "raingage", "imperv", "snow_pack", "N_Imperv", "N_Perv", "S_Imperv",
+    "S_Perv", "PctZero", "RouteTo", "PctRouted", "Suction", "HydCon",
+    "IMDmax", "tag",
+]
+
+# Catchment property table columns, by position. Columns past PctZero
+# and raingage are optional and fall back to the Cell defaults.
+CATCHMENT_TABLE_COLUMNS = [
+    "landuse", "imperv", "S_Imperv", "N_Imperv", "S_Perv", "N_Perv",
+    "PctZero", "raingage", "HydCon", "IMDmax", "Suction", "snow_pack", "tag",
+]
+
+# Per-cell attributes exposed by Grid.to_frame(), in output column order
+CELL_COLUMNS = [
+    "name", "center_x", "center_y", "elevation", "flowdir", "cell_size",
+    "slope", "area", "flow_width", "landuse", "outlet_x", "outlet_y",
+    "outlet_id", "outlet", "is_sink",
+]
+
+SLOPE_METHODS = ("d8", "flowdir", "horn")
+
+# Ways of grouping cells into regions for the raster-domain dissolve
+REGION_MODES = ("flow", "outlet")
+
+# Kinds of node in the outlet id space (see NodeRegistry)
+NODE_KINDS = ("cell", "junction", "outfall")
+
+# Points queried against the junction index per batch
+JUNCTION_QUERY_CHUNK = 1_000_000
+
+
+def default_landuse_params() -> dict:
+    """Default subcatchment parameters, taken from the Cell dataclass."""
+    defaults = {f.name: f.default for f in fields(Cell)}
+    return {key: defaults[key] for key in LANDUSE_PARAMS}
+
+
+def compile_landuse_params(table: pd.DataFrame):
+    """
+    Compile a per-landuse parameter table (indexed by landuse code) into a
+    code -> row lookup array and one value array per parameter. Row 0 of
+    every value array holds the Cell default used for unknown codes; codes
+    below 0 never get a lookup entry, so they are unknown too.
+    """
+    defaults = default_landuse_params()
+    codes = table.index.to_numpy(dtype=np.int64)
+    known = codes >= 0
+
+    lut = np.zeros(codes[known].max() + 1 if known.any() else 1, dtype=np.int32)
+    lut[codes[known]] = np.arange(1, codes.size + 1)[known]
+
+    values = {}
+    for key in LANDUSE_PARAMS:
+        column = table[key] if key in table else pd.Series(index=table.index, dtype=object)
+        numeric = pd.to_numeric(column, errors="coerce")
+        try:
+            default = float(defaults[key])
+        except ValueError:
+            default = None
+
+        # Numeric parameters become float arrays, the rest stay as objects
+        if default is not None and numeric.notna().sum() == column.notna().sum():
+            values[key] = np.concatenate([[default], numeric.fillna(default).to_numpy(float)])
+        else:
+            filled = column.where(column.notna(), defaults[key]).astype(str)
+            values[key] = np.concatenate([[defaults[key]], filled.to_numpy(object)]).astype(object)
+    return lut, values
+
+
+def nearest_junctions(junctions: List[Junction], x: np.ndarray, y: np.ndarray,
+                      max_distance: Optional[float] = None):
+    """
+    Nearest open junction for every (x, y) point, queried in batches
+    against one STRtree. Returns the index into junctions and the distance;
+    points with no open junction within max_distance get -1 and inf.
+    Equidistant junctions resolve to the lowest index.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    index = np.full(x.shape, -1, dtype=np.int64)
+    distance = np.full(x.shape, np.inf)
+
+    open_index = np.flatnonzero([j.is_open for j in junctions])
+    if open_index.size == 0 or x.size == 0:
+        return index, distance
+
+    tree = STRtree(shapely.points([(junctions[i].x, junctions[i].y) for i in open_index]))
+
+    for start in range(0, x.size, JUNCTION_QUERY_CHUNK):
+        stop = min(start + JUNCTION_QUERY_CHUNK, x.size)
+        points = shapely.points(x[start:stop], y[start:stop])
+        (src, dst), dist = tree.query_nearest(
+            points, max_distance=max_distance, return_distance=True, all_matches=True
+        )
+
+        # Ties come back as several pairs per point: keep the lowest index
+        order = np.lexsort((dst, src))
+        src, dst, dist = src[order], dst[order], dist[order]
+        first = np.ones(src.size, dtype=bool)
+        first[1:] = src[1:] != src[:-1]
+
+        index[start + src[first]] = open_index[dst[first]]
+        distance[start + src[first]] = dist[first]
+
+    return index, distance
+
+
+def cell_names(index: np.ndarray, ncols: int) -> np.ndarray:
+    """Render 's{row}_{col}' names for an array of flat cell indices."""
+    rows, cols = np.divmod(np.asarray(index, dtype=np.int64), ncols)
+    return np.char.add(np.char.add("s", rows.astype(str)), np.char.add("_", cols.astype(str)))
+
+
+class CellIndex:
+    """
+    Dense numbering of the active cells of a raster. Dense ids 0..n-1 follow
+    flat index order; flat maps them to flat raster indices and dense maps
+    flat indices back (-1 for inactive cells).
+    """
+
+    def __init__(self, mask: np.ndarray):
+        self.shape = mask.shape
+        self.mask = mask
+        self.flat = np.flatnonzero(mask)
+        dtype = np.int32 if mask.size < np.iinfo(np.int32).max else np.int64
+        self.dense = np.full(mask.size, -1, dtype=dtype)
+        self.dense[self.flat] = np.arange(self.flat.size, dtype=dtype)
+
+    @property
+    def size(self) -> int:
+        return self.flat.size
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.flat // self.shape[1]
+
+    @property
+    def cols(self) -> np.ndarray:
+        return self.flat % self.shape[1]
+
+    def to_dense(self, flat: np.ndarray) -> np.ndarray:
+        """Dense ids of flat indices; -1 for inactive cells and negative input."""
+        flat = np.asarray(flat)
+        ids = np.full(flat.shape, -1, dtype=np.int64)
+        inside = flat >= 0
+        ids[inside] = self.dense[flat[inside]]
+        return ids
+
+    def gather(self, array: np.ndarray) -> np.ndarray:
+        """Values of a full (nrows, ncols) array at the active cells, in dense order."""
+        return array.ravel()[self.flat]
+
+    def scatter(self, values: np.ndarray, fill) -> np.ndarray:
+        """Full (nrows, ncols) array of per-active-cell values, fill elsewhere."""
+        values = np.asarray(values)
+        out = np.full(self.dense.size, fill, dtype=np.result_type(values.dtype, np.min_scalar_type(fill)))
+        out[self.flat] = values
+        return out.reshape(self.shape)
+
+
+class NodeRegistry:
+    """
+    One integer id space for everything a subcatchment can drain to. Ids
+    0..n-1 are the active cells (their dense ids), named nodes such as
+    junctions and outfalls follow in registration order, and -1 is no
+    outlet. Names are rendered from the ids only when a writer asks.
+    """
+
+    def __init__(self, cells: CellIndex, centers):
+        self.cells = cells
+        self.centers = centers  # flat cell index -> (x, y)
+        self._names: List[str] = []
+        self._kinds: List[str] = []
+        self._x: List[float] = []
+        self._y: List[float] = []
+        self._ids = {}
+
+    def __len__(self) -> int:
+        return self.cells.size + len(self._names)
+
+    def add(self, names: Iterable[str], kind: str, x=None, y=None) -> np.ndarray:
+        """
+        Register named nodes of one of NODE_KINDS and return their ids. A
+        name registered before keeps its id.
+        """
+        if kind not in NODE_KINDS[1:]:
+            raise ValueError(f"Unknown node kind '{kind}', expected one of {NODE_KINDS[1:]}")
+        names = [str(name) for name in names]
+        x = np.full(len(names), np.nan) if x is None else np.asarray(x, dtype=float)
+        y = np.full(len(names), np.nan) if y is None else np.asarray(y, dtype=float)
+
+        ids = np.empty(len(names), dtype=np.int64)
+        for i, name in enumerate(names):
+            if name not in self._ids:
+                self._ids[name] = self.cells.size + len(self._names)
+                self._names.append(name)
+                self._kinds.append(kind)
+                self._x.append(x[i])
+                self._y.append(y[i])
+            ids[i] = self._ids[name]
+        return ids
+
+    def is_cell(self, ids: np.ndarray) -> np.ndarray:
+        return (ids >= 0) & (ids < self.cells.size)
+
+    def kinds(self, ids: np.ndarray) -> np.ndarray:
+        """Node kind per id ("none" for -1)."""
+        ids = np.asarray(ids)
+        kinds = np.full(ids.shape, "none", dtype=object)
+        kinds[self.is_cell(ids)] = "cell"
+        named = ids >= self.cells.size
+        kinds[named] = np.array(self._kinds, dtype=object)[ids[named] - self.cells.size]
+        return kinds
+
+    def names(self, ids: np.ndarray) -> np.ndarray:
+        """Render node names: 's{row}_{col}' for cells, the registered name otherwise, '*' for -1."""
+        ids = np.asarray(ids)
+        names = np.full(ids.shape, "*", dtype=object)
+        cell = self.is_cell(ids)
+        names[cell] = cell_names(self.cells.flat[ids[cell]], self.cells.shape[1])
+        named = ids >= self.cells.size
+        names[named] = np.array(self._names, dtype=object)[ids[named] - self.cells.size]
+        return names
+
+    def categorical(self, ids: np.ndarray) -> pd.Categorical:
+        """Node names as a Categorical, rendering each distinct id once."""
+        uniques, codes = np.unique(np.asarray(ids), return_inverse=True)
+        return pd.Categorical.from_codes(codes.ravel(), categories=self.names(uniques))
+
+    def coords(self, ids: np.ndarray):
+        """Node coordinates: cell centers, registered x/y otherwise, 0 for -1."""
+        ids = np.asarray(ids)
+        x, y = np.zeros(ids.shape), np.zeros(ids.shape)
+        cell = self.is_cell(ids)
+        x[cell], y[cell] = self.centers(self.cells.flat[ids[cell]])
+        named = ids >= self.cells.size
+        x[named] = np.array(self._x)[ids[named] - self.cells.size]
+        y[named] = np.array(self._y)[ids[named] - self.cells.size]
+        return x, y
+
 
 class Grid:
-    def __init__(self, dem: Raster, flowdir: Raster, landuse: Raster):
+    """
+    Columnar raster grid.
+
+    Every per-cell attribute is a typed (nrows, ncols) NumPy array and the
+    landuse dependent subcatchment parameters live in a small table indexed
+    by landuse code. Cell objects are only built on request via cell().
+    """
+
+    def __init__(self, dem: Raster, flowdir: Optional[Raster], landuse: Raster, flowdir_encoding: str = "grass",
+                 scratch_dir: Optional[str] = None):
+        if flowdir_encoding not in FLOWDIR_ENCODINGS:
+            raise ValueError(f"Unknown flow direction encoding '{flowdir_encoding}', "
+                             f"expected one of {sorted(FLOWDIR_ENCODINGS)}")
+        for name, layer in (("flowdir", flowdir), ("landuse", landuse)):
+            if layer is not None and layer.array.shape != dem.array.shape:
+                raise ValueError(f"{name} raster has shape {layer.array.shape}, DEM has {dem.array.shape}; "
+                                 "load the inputs through RasterStack to align them")
+
         self.dem = dem
-        self.flowdir = flowdir
-        self.landuse = landuse
+        self.transform = dem.transform
+        self.crs = dem.crs
 
         self.nrows, self.ncols = dem.array.shape
         self.cellsize = dem.resolution
+        # Per-cell work arrays are memory-mapped under scratch_dir when given
+        self.scratch_dir = scratch_dir
+        # Flat indices and node ids fit int32 up to 2**30 cells (room left for junction ids)
+        self.index_dtype = np.int32 if self.nrows * self.ncols < 2**30 else np.int64
+
+        shape = (self.nrows, self.ncols)
+        # Rasters keep their native dtypes; nodata is tracked by masks
+        self.valid = dem.mask
+        self.elevation = dem.array
+        if not np.issubdtype(self.elevation.dtype, np.floating):
+            self.elevation = self.elevation.astype(np.float32)
+        if flowdir is not None:
+            self.flowdir = self._masked_codes(flowdir, -1, scratch_dir)
+        else:
+            # No flow direction raster: derive it later with fill_depressions()
+            self.flowdir = self._full(-1, np.int16)
+        self.landuse = self._masked_codes(landuse, LANDUSE["LANDUSE_NONE"], scratch_dir)
+        self.flowdir_encoding = flowdir_encoding
+        self.flow_direction = self.decode_flowdir(self.flowdir, flowdir_encoding)
+
+        # Cells with an elevation and a landuse class are the model; routing,
+        # accumulation and the writers only visit these
+        self.active = CellIndex(self.valid & (self.landuse != LANDUSE["LANDUSE_NONE"]))
+        self.nodes = NodeRegistry(self.active, self.centers)
+
+        # Cells are square and equal, so area is one value broadcast over the grid
+        self.cell_area = float(self.cellsize**2)
+        self.area = np.broadcast_to(np.float64(self.cell_area), shape)
+        self.slope = self._full(0, np.float32)
+        self.flow_width = self._full(0, np.float32)
+        # Node id of each cell's outlet (see NodeRegistry), -1 for none
+        self.outlet_id = self._full(-1, self.index_dtype)
+        self.is_sink = self._full(0, np.int8)
+
+        # Distance to the neighbor in each D8 direction (constant over the
+        # grid) and the steepest downslope neighbor of every cell
+        self.neighbor_distances = self._direction_distances()
+        self.downslope_index = None
+        self.downslope_distance = None
+
+        # Flat index of the D8 downstream cell, filled by route_by_flowdir()
+        self.downstream = None
+
+        # Cells containing an open junction, filled by mark_inlets()
+        self.has_inlet = self._full(False, bool)
+
+        # Flow accumulation results, filled by compute_flow_accumulation()
+        self.contributing_area = None
+        self.flow_length = None
+        self.watershed = None
+
+        self.landuse_params = pd.DataFrame(columns=LANDUSE_PARAMS, dtype=object)
+        self.landuse_params.index.name = "landuse"
+        self._param_lut, self._param_values = compile_landuse_params(self.landuse_params)
+        self.unknown_landuse = {}
+
+    def _full(self, value, dtype) -> np.ndarray:
+        """A (nrows, ncols) work array filled with value."""
+        array = hydrology.work_array((self.nrows, self.ncols), dtype, self.scratch_dir)
+        array[:] = value
+        return array
 
-        self.cells = np.empty((self.nrows, self.ncols), dtype=object)
-        self._initialize_cells()
-
-    def _initialize_cells(self):
-        for row in range(self.nrows):
-            for col in range(self.ncols):
-                elev = self.dem.get_value_at(row, col)
+    @staticmethod
+    def _masked_codes(raster: Raster, nodata: int, scratch_dir: Optional[str] = None) -> np.ndarray:
+        """
+        Integer class codes with nodata cells set to the given value, in the
+        smallest integer dtype that holds both the codes and nodata. Without
+        nodata cells the raster's array is used as is when the dtype fits;
+        otherwise the codes are written once into a new work array.
+        """
+        array = raster.array
+        if np.issubdtype(array.dtype, np.floating):
+            dtype = np.int32
+        else:
+            dtype = np.result_type(array.dtype, np.min_scalar_type(nodata))
+        if raster.mask.all():
+            return array.astype(dtype, copy=False)
+        codes = hydrology.work_array(array.shape, dtype, scratch_dir)
+        codes[:] = nodata
+        np.copyto(codes, array, casting="unsafe", where=raster.mask)
+        return codes
+
+    @property
+    def size(self):
+        return self.nrows * self.ncols
+
+    def index(self, row: int, col: int) -> int:
+        return row * self.ncols + col
+
+    @property
+    def center_x(self) -> np.ndarray:
+        return self.dem.center_grids()[0]
+
+    @property
+    def center_y(self) -> np.ndarray:
+        return self.dem.center_grids()[1]
+
+    def centers(self, index: np.ndarray):
+        """Center coordinates of cells given by flat index, from the DEM's center vectors."""
+        rows, cols = np.divmod(index, self.ncols)
+        return self.dem.centers(rows, cols)
+
+    def cell(self, row: int, col: int) -> Cell:
+        """Materialize a single Cell object for inspection."""
+        land = int(self.landuse[row, col])
+        params = {key: values[0] for key, values in self.landuse_param_arrays(np.array([land])).items()}
+
+        x, y = self.dem.get_coords(row, col)
+        outlet_id = self.outlet_id[row, col:col + 1]
+        (outlet_x,), (outlet_y,) = self.nodes.coords(outlet_id)
+        cell = Cell(
+            name=f"s{row}_{col}",
+            center_x=x,
+            center_y=y,
+            elevation=float(self.elevation[row, col]) if self.valid[row, col] else np.nan,
+            flowdir=int(self.flowdir[row, col]),
+            cell_size=self.cellsize,
+            slope=float(self.slope[row, col]),
+            area=float(self.area[row, col]),
+            flow_width=float(self.flow_width[row, col]),
+            landuse=land,
+            outlet_x=float(outlet_x),
+            outlet_y=float(outlet_y),
+            outlet_id=int(outlet_id[0]),
+            outlet=str(self.nodes.names(outlet_id)[0]),
+            is_sink=int(self.is_sink[row, col]),
+            **params
+        )
+        cell.outlet_coord = (cell.outlet_x, cell.outlet_y)
+
+        if self.valid[row, col]:
+            for i, (dr, dc) in enumerate(self.get_neighbor_offsets()):
+                r2, c2 = row + dr, col + dc
+                if 0 <= r2 < self.nrows and 0 <= c2 < self.ncols and self.valid[r2, c2]:
+                    cell.neighbor_indices[i] = self.index(r2, c2)
+                    cell.neighbor_distances[i] = float(self.neighbor_distances[i])
+        return cell
+
+    def to_frame(self, index: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        Flatten the grid into one DataFrame row per cell, with the landuse
+        parameters gathered from the per-landuse table. index selects cells
+        by flat index (the active cells by default). Names are rendered
+        here; the outlet column is categorical.
+        """
+        if index is None:
+            index = self.active.flat
+        center_x, center_y = self.centers(index)
+        outlet_id = self.outlet_id.ravel()[index]
+        outlet_x, outlet_y = self.nodes.coords(outlet_id)
+        data = {
+            "name": cell_names(index, self.ncols),
+            "center_x": center_x,
+            "center_y": center_y,
+            "cell_size": np.full(index.size, self.cellsize),
+            "area": np.full(index.size, self.cell_area),
+            "elevation": np.where(self.valid.ravel()[index], self.elevation.ravel()[index], np.nan),
+            "outlet_x": outlet_x,
+            "outlet_y": outlet_y,
+            "outlet_id": outlet_id,
+            "outlet": self.nodes.categorical(outlet_id),
+        }
+        for col in CELL_COLUMNS:
+            if col not in data:
+                data[col] = getattr(self, col).ravel()[index]
+        frame = pd.DataFrame(data, columns=CELL_COLUMNS)
+
+        for key, values in self.landuse_param_arrays(self.landuse.ravel()[index]).items():
+            frame[key] = values
+        return frame
+
+    def landuse_param_arrays(self, landuse: Optional[np.ndarray] = None) -> dict:
+        """
+        Gather every landuse parameter for the given landuse codes (all
+        cells, flattened, by default) through the compiled lookup table.
+        """
+        if landuse is None:
+            landuse = self.landuse.ravel()
+        lut = self._param_lut
+        rows = lut[np.clip(landuse, 0, lut.size - 1)]
+        rows[(landuse < 0) | (landuse >= lut.size)] = 0
+        return {key: values[rows] for key, values in self._param_values.items()}
 
-                # ⚠️ Handle NaNs or invalid values gracefully
-                land_raw = self.landuse.get_value_at(row, col)
-                land = 0 if land_raw is None or math.isnan(land_raw) else int(land_raw)
+    @staticmethod
+    def get_neighbor_offsets():
+        return list(D8_OFFSETS)
 
-                flow_raw = self.flowdir.get_value_at(row, col)
-                flow = -1 if flow_raw is None or math.isnan(flow_raw) else int(flow_raw)
+    @classmethod
+    def decode_flowdir(cls, codes: np.ndarray, encoding: str = "grass") -> np.ndarray:
+        """
+        Translate raw flow direction codes into indices of get_neighbor_offsets()
+        through a lookup table. Unknown codes decode to -1.
+        """
+        table = FLOWDIR_ENCODINGS[encoding]
+        offsets = cls.get_neighbor_offsets()
+        keys = np.array(sorted(table))
+        lo, hi = keys.min(), keys.max()
 
-                x, y = self.dem.get_coords(row, col)
-                name = f"s{row}_{col}"
+        lut = np.full(hi - lo + 1, -1, dtype=np.int8)
+        lut[keys - lo] = [offsets.index(table[k]) for k in keys]
 
-                self.cells[row, col] = Cell(
-                    name=name,
-                    center_x=x,
-                    center_y=y,
-                    elevation=elev,
-                    landuse=land,
-                    flowdir=flow,
-                    cell_size=self.cellsize,
-                    area=self.cellsize**2
-                )
+        codes = np.asarray(codes)
+        direction = np.full(codes.shape, -1, dtype=np.int8)
+        known = (codes >= lo) & (codes <= hi)
+        direction[known] = lut[codes[known] - lo]
+        return direction
 
     @staticmethod
-    def get_neighbor_offsets():
-        return [
-            (-1, 1),  # NE
-            (-1, 0),  # N
-            (-1, -1), # NW
-            (0, -1),  # W
-            (1, -1),  # SW
-            (1, 0),   # S
-            (1, 1),   # SE
-            (0, 1),   # E
-        ]
-
-    def compute_neighbors_and_slopes(self):
-        offsets = self.get_neighbor_offsets()
-
-        for row in range(self.nrows):
-            for col in range(self.ncols):
-                cell = self.cells[row, col]
-                if cell is None or cell.elevation is None or math.isnan(cell.elevation):
-                    continue
-
-                for i, (dr, dc) in enumerate(offsets):
-                    r2, c2 = row + dr, col + dc
-                    if 0 <= r2 < self.nrows and 0 <= c2 < self.ncols:
-                        neighbor = self.cells[r2, c2]
-                        if neighbor is None or neighbor.elevation is None or math.isnan(neighbor.elevation):
-                            continue
-
-                        dx = cell.center_x - neighbor.center_x
-                        dy = cell.center_y - neighbor.center_y
-                        dist = np.hypot(dx, dy)
-
-                        slope = (cell.elevation - neighbor.elevation) / dist if dist > 0 else 0
-                        cell.neighbor_indices[i] = r2 * self.ncols + c2
-                        cell.neighbor_distances[i] = dist
+    def encode_flowdir(direction: np.ndarray, encoding: str = "grass") -> np.ndarray:
+        """Inverse of decode_flowdir: direction indices back to raster codes (-1 for none)."""
+        table = FLOWDIR_ENCODINGS[encoding]
+        by_offset = {offset: code for code, offset in table.items()}
+        lut = np.array([by_offset[offset] for offset in D8_OFFSETS] + [-1], dtype=np.int16)
+        return lut[direction]
+
+    def _shift_slices(self, dr: int, dc: int):
+        """
+        Slices selecting every cell that has an in-bounds neighbor at
+        offset (dr, dc), and the matching slices of those neighbors.
+        """
+        def axis(d, n):
+            if d >= 0:
+                return slice(0, n - d), slice(d, n)
+            return slice(-d, n), slice(0, n + d)
+
+        src_r, dst_r = axis(dr, self.nrows)
+        src_c, dst_c = axis(dc, self.ncols)
+        return (src_r, src_c), (dst_r, dst_c)
+
+    def _direction_distances(self) -> np.ndarray:
+        """Center-to-center distance for each D8 direction, from the transform."""
+        a, b, _, d, e, _ = self.transform[:6]
+        return np.array([np.hypot(a * dc + b * dr, d * dc + e * dr)
+                         for dr, dc in self.get_neighbor_offsets()])
+
+    def neighbor_index(self, direction: int) -> np.ndarray:
+        """
+        Flat index of the neighbor in the given D8 direction for every cell,
+        or -1 where the neighbor is outside the grid or has no elevation.
+        """
+        flat = np.arange(self.size, dtype=np.int64).reshape(self.nrows, self.ncols)
+        valid = self.valid
+        index = np.full((self.nrows, self.ncols), -1, dtype=np.int64)
+
+        src, dst = self._shift_slices(*self.get_neighbor_offsets()[direction])
+        index[src] = np.where(valid[src] & valid[dst], flat[dst], -1)
+        return index
+
+    def compute_neighbors_and_slopes(self, method: str = "d8"):
+        """
+        Find the steepest downslope neighbor of every cell and compute the
+        cell slope (m/m) using one of SLOPE_METHODS:
+
+        - "d8": steepest descent drop to any of the 8 neighbors
+        - "flowdir": drop towards the neighbor given by the flow direction raster
+        - "horn": Horn (1981) 3x3 finite difference gradient
+        """
+        if method not in SLOPE_METHODS:
+            raise ValueError(f"Unknown slope method '{method}', expected one of {SLOPE_METHODS}")
+
+        shape = (self.nrows, self.ncols)
+        flat = np.arange(self.size, dtype=np.int64).reshape(shape)
+        valid = self.valid
+
+        steepest = np.zeros(shape)
+        self.downslope_index = self._full(-1, self.index_dtype)
+        self.downslope_distance = self._full(0, np.float32)
+
+        for i, (dr, dc) in enumerate(self.get_neighbor_offsets()):
+            src, dst = self._shift_slices(dr, dc)
+            dist = self.neighbor_distances[i]
+
+            drop = (self.elevation[src] - self.elevation[dst]) / dist
+            better = valid[src] & valid[dst] & (drop > steepest[src])
+
+            steepest[src][better] = drop[better]
+            self.downslope_index[src][better] = flat[dst][better]
+            self.downslope_distance[src][better] = dist
+
+        if method == "flowdir":
+            steepest = self._flowdir_slope(valid)
+        elif method == "horn":
+            steepest = self._horn_slope(valid)
+        self.slope[:] = steepest
+
+    def _flowdir_slope(self, valid: np.ndarray) -> np.ndarray:
+        slope = np.zeros((self.nrows, self.ncols))
+
+        for i, (dr, dc) in enumerate(self.get_neighbor_offsets()):
+            src, dst = self._shift_slices(dr, dc)
+            sel = (self.flow_direction[src] == i) & valid[src] & valid[dst]
+            drop = (self.elevation[src] - self.elevation[dst]) / self.neighbor_distances[i]
+            slope[src][sel] = np.maximum(drop[sel], 0.0)
+        return slope
+
+    def _horn_slope(self, valid: np.ndarray) -> np.ndarray:
+        # Missing neighbors (nodata or outside the grid) take the center value
+        padded = np.pad(self.elevation, 1)
+        padded_valid = np.pad(valid, 1)
+
+        def z(dr, dc):
+            rows = slice(1 + dr, 1 + dr + self.nrows)
+            cols = slice(1 + dc, 1 + dc + self.ncols)
+            return np.where(padded_valid[rows, cols], padded[rows, cols], self.elevation)
+
+        dx = self.neighbor_distances[7]  # E
+        dy = self.neighbor_distances[5]  # S
+        dzdx = ((z(-1, 1) + 2 * z(0, 1) + z(1, 1)) - (z(-1, -1) + 2 * z(0, -1) + z(1, -1))) / (8 * dx)
+        dzdy = ((z(1, -1) + 2 * z(1, 0) + z(1, 1)) - (z(-1, -1) + 2 * z(-1, 0) + z(-1, 1))) / (8 * dy)
+
+        return np.where(valid, np.hypot(dzdx, dzdy), 0.0)
 
     def route_by_flowdir(self):
-        for row in range(self.nrows):
-            for col in range(self.ncols):
-                cell = self.cells[row, col]
-                if cell.flowdir == -1:
-                    continue
-
-                direction = cell.flowdir - 1  # SWMM assumes flowdir 1–8
-                if 0 <= direction < 8:
-                    offset = self.get_neighbor_offsets()[direction]
-                    r2, c2 = row + offset[0], col + offset[1]
-                    if 0 <= r2 < self.nrows and 0 <= c2 < self.ncols:
-                        neighbor = self.cells[r2, c2]
-                        if neighbor and neighbor.landuse >= LANDUSE["BUILT_AREA"]:
-                            cell.outlet = neighbor.name
-                            cell.outlet_id = r2 * self.ncols + c2
-                            cell.outlet_x = neighbor.center_x
-                            cell.outlet_y = neighbor.center_y
-                            dist = cell.neighbor_distances[direction]
-                            if dist > 0:
-                                cell.flow_width = cell.area / dist
-
-    def route_to_junctions(self, junctions: List[Junction]):
-        """
-        Assign each cell an outlet if it overlaps or is near an open junction.
-        Uses nearest neighbor logic with STRtree spatial index.
-        """
-        # Create a list of geometry objects shared between STRtree and map
-        junction_geoms = []
-        coord_to_junction = {}
-
-        for j in junctions:
-            if j.is_open:
-                pt = Point(j.x, j.y)
-                junction_geoms.append(pt)
-                coord_to_junction[(pt.x, pt.y)] = j
-
-        tree = STRtree(junction_geoms)
-
-        # Assign each cell to its nearest junction
-        for row in self.cells:
-            for cell in row:
-                if cell is None or cell.landuse == 0:
-                    continue
-
-                cell_pt = Point(cell.center_x, cell.center_y)
-                nearest_idx = tree.nearest(cell_pt)         # Returns an int
-                nearest_geom = tree.geometries[nearest_idx] # ✅ Get geometry
-                nearest_junction = coord_to_junction[(nearest_geom.x, nearest_geom.y)]
-
-                # Set outlet info
-                cell.outlet = nearest_junction.name
-                cell.outlet_id = nearest_junction.name
-                cell.outlet_x = nearest_junction.x
-                cell.outlet_y = nearest_junction.y
+        """
+        Route every active cell to its D8 downstream neighbor. The decoded
+        flow directions are turned into flat downstream indices in one step;
+        flow into an inactive cell leaves the model (-1), as does the lowest
+        cell of every flow cycle. The outlet is only set where the downstream
+        cell is BUILT_AREA or above.
+        """
+        cells = self.active
+        offsets = np.array(self.get_neighbor_offsets() + [(0, 0)])
+        direction = cells.gather(self.flow_direction)  # -1 picks the (0, 0) sentinel
+
+        r2 = cells.rows + offsets[direction, 0]
+        c2 = cells.cols + offsets[direction, 1]
+        inside = (direction >= 0) & (r2 >= 0) & (r2 < self.nrows) & (c2 >= 0) & (c2 < self.ncols)
+        target = np.where(inside, r2 * self.ncols + c2, -1)
+        target[inside] = np.where(cells.mask.ravel()[target[inside]], target[inside], -1)
+
+        # Flow cycles would leave their cells and everything upstream of them unrouted
+        dense = cells.to_dense(target)
+        cut = hydrology.cycle_outlets(dense, hydrology.topological_levels(dense), cells.gather(self.elevation))
+        if cut.size:
+            print(f"⚠️ Flow directions form {cut.size} cycles; their lowest cells drain nowhere and become sinks")
+            target[cut] = -1
+        self.downstream = cells.scatter(target, -1).astype(self.index_dtype, copy=False)
+
+        routed = target >= 0
+        routed[routed] = self.landuse.ravel()[target[routed]] >= LANDUSE["BUILT_AREA"]
+        source, target = cells.flat[routed], target[routed]
+
+        self.outlet_id.ravel()[source] = cells.dense[target]
+
+        # Both ends are active, so both have an elevation
+        dist = self.neighbor_distances[direction[routed]]
+        self.flow_width.ravel()[source] = self.cell_area / dist
+
+        self.mark_sinks()
+
+    def active_downstream(self) -> np.ndarray:
+        """The downstream pointers as dense active-cell ids, for graph passes over the active cells."""
+        if self.downstream is None:
+            self.route_by_flowdir()
+        return self.active.to_dense(self.active.gather(self.downstream))
+
+    def assign_junctions(
+        self, junctions: List[Junction],
+        unrouted_only: bool = False,
+        landuse: Optional[Iterable[int]] = None,
+        max_distance: Optional[float] = None
+    ):
+        """
+        Find the nearest open junction for every active cell in one batched
+        query. Candidates can be limited to cells without a downstream
+        outlet and to the given landuse codes.
+
+        Returns (cell, junction, distance) arrays: flat cell indices, the
+        index into junctions (-1 if none within max_distance) and distance.
+        """
+        candidates = self.active.mask.copy()
+        if unrouted_only:
+            candidates &= self.outlet_id == -1
+        if landuse is not None:
+            candidates &= np.isin(self.landuse, list(landuse))
+
+        cells = np.flatnonzero(candidates)
+        x, y = self.centers(cells)
+        junction, distance = nearest_junctions(junctions, x, y, max_distance)
+        return cells, junction, distance
+
+    def route_to_junctions(
+        self, junctions: List[Junction],
+        unrouted_only: bool = False,
+        landuse: Optional[Iterable[int]] = None,
+        max_distance: Optional[float] = None
+    ):
+        """
+        Assign cells to their nearest open junction (see assign_junctions).
+        Cells with no junction within max_distance keep their outlet.
+        """
+        cells, junction, _ = self.assign_junctions(junctions, unrouted_only, landuse, max_distance)
+        found = junction >= 0
+        cells, junction = cells[found], junction[found]
+
+        ids = self.nodes.add(
+            [j.name for j in junctions], "junction",
+            [j.x for j in junctions], [j.y for j in junctions]
+        )
+        self.outlet_id.ravel()[cells] = ids[junction]
+        self.is_sink.ravel()[cells] = 2
+
+    def fill_depressions(self, derive_flowdir: bool = False, epsilon: bool = True,
+                         scratch_dir: Optional[str] = None):
+        """
+        Fill pits and resolve flats in the DEM with Priority-Flood (see
+        hydrology.priority_flood). With derive_flowdir the flow directions
+        are replaced by the ones traced by the flood, so no flow direction
+        raster is needed. Work arrays go under scratch_dir, the grid's by
+        default.
+        """
+        if scratch_dir is None:
+            scratch_dir = self.scratch_dir
+        filled, direction = hydrology.priority_flood(self.elevation, self.valid, epsilon, scratch_dir)
+        self.elevation = filled
+        if derive_flowdir:
+            self.flow_direction = direction
+            self.flowdir = self.encode_flowdir(direction, self.flowdir_encoding)
+
+    def mark_sinks(self):
+        """
+        Flag in bulk the active cells without a downstream cell in the model
+        as sinks (is_sink = 1). Cells forced to a junction keep 2.
+        """
+        if self.downstream is None:
+            self.route_by_flowdir()
+        sink = self.active.mask & (self.downstream < 0)
+        self.is_sink[sink & (self.is_sink != 2)] = 1
+        self.is_sink[~sink & (self.is_sink == 1)] = 0
+
+    def mark_inlets(self, junctions: List[Junction]):
+        """Flag the cells that contain an open junction."""
+        points = [(j.x, j.y) for j in junctions if j.is_open]
+        if not points:
+            return
+        x, y = np.array(points, dtype=float).T
+        cols, rows = ~self.transform * (x, y)
+        rows, cols = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.nrows) & (cols >= 0) & (cols < self.ncols)
+        self.has_inlet[rows[inside], cols[inside]] = True
+
+    def compute_flow_accumulation(self):
+        """
+        Accumulate over the D8 downstream pointers in one topological pass:
+
+        - contributing_area: area (m²) draining through each cell, itself included
+        - flow_length: flow path length (m) down to the nearest cell holding a
+          junction (see mark_inlets), NaN if the path never reaches one
+        - watershed: index of the D8 outlet each cell drains to, -1 outside the model
+
+        The pass runs over the active cells only, on dense ids; results are
+        scattered back onto the grid.
+        """
+        cells = self.active
+        downstream = self.active_downstream()
+        levels = hydrology.topological_levels(downstream)
+
+        area = hydrology.accumulate(downstream, levels, np.full(cells.size, self.cell_area))
+        self.contributing_area = cells.scatter(area, np.nan)
+
+        step = self.neighbor_distances[cells.gather(self.flow_direction)]
+        length = hydrology.distance_to_target(downstream, levels, step, cells.gather(self.has_inlet))
+        self.flow_length = cells.scatter(length, np.nan)
+
+        watershed = hydrology.watershed_labels(downstream, levels, np.ones(cells.size, dtype=bool))
+        self.watershed = cells.scatter(watershed, -1)
+
+    def region_labels(self, by: str = "flow") -> np.ndarray:
+        """
+        Label cells into the regions a dissolve would merge them into, as a
+        (nrows, ncols) int64 array with -1 outside the model. With "flow" a
+        cell joins the region of the cell it is routed to when both share
+        a landuse, which is the vector dissolve rule applied all the way
+        up each flow path. With "outlet" the label is the pair of landuse
+        and outlet, so regions are the cells draining to the same place.
+        """
+        if by not in REGION_MODES:
+            raise ValueError(f"Unknown region mode '{by}', expected one of {REGION_MODES}")
+
+        cells = self.active
+        landuse = cells.gather(self.landuse)
+        outlet_id = cells.gather(self.outlet_id)
+
+        if by == "outlet":
+            # Cells, junctions and outfalls share one id space, so the id is the key
+            labels = pd.factorize(pd.MultiIndex.from_arrays([landuse, outlet_id]))[0]
+            return cells.scatter(labels, -1).astype(np.int64, copy=False)
+
+        # Outlets that are cells are dense ids, i.e. the routing graph
+        downstream = np.where(self.nodes.is_cell(outlet_id), outlet_id, -1)
+        joined = downstream >= 0
+        joined[joined] = landuse[downstream[joined]] == landuse[joined]
+        downstream[~joined] = -1
+
+        levels = hydrology.topological_levels(downstream)
+        labels = hydrology.watershed_labels(downstream, levels, np.ones(cells.size, dtype=bool))
+        return cells.scatter(labels, -1)
+
+    def region_frame(self, labels: np.ndarray) -> pd.DataFrame:
+        """
+        One subcatchment row per region label, reduced from the cells with
+        bincount: summed area, area-weighted elevation, slope and center,
+        and the landuse parameters of the region's landuse. A region drains
+        to the region (or junction) its outlet cell is routed to; regions
+        are named sc1..scN.
+        """
+        flat = labels.ravel()
+        cells = np.flatnonzero(flat >= 0)
+        label = flat[cells]
+        n = int(label.max()) + 1 if label.size else 0
+
+        area = np.full(cells.size, self.cell_area)
+        x, y = self.centers(cells)
+
+        def weighted(values):
+            return np.bincount(label, weights=area * values, minlength=n) / total
+
+        total = np.bincount(label, weights=area, minlength=n)
+        names = np.char.add("sc", np.arange(1, n + 1).astype(str)).astype(object)
+
+        # Every region has one outlet cell: the cell that leaves the region
+        outlet_id = self.outlet_id.ravel()[cells]
+        to_cell = self.nodes.is_cell(outlet_id)
+        target_label = np.full(cells.size, -1, dtype=np.int64)
+        target_label[to_cell] = flat[self.active.flat[outlet_id[to_cell]]]
+        leaves = target_label != label
+
+        # Labels are 0..n-1 with no gaps, so this is the first cell of every region
+        first = np.unique(label, return_index=True)[1]
+        exit_cell = first.copy()
+        exit_cell[label[leaves]] = np.flatnonzero(leaves)
+
+        exit_target = target_label[exit_cell]
+        outlet = self.nodes.names(outlet_id[exit_cell])
+        into_region = exit_target >= 0
+        outlet[into_region] = names[exit_target[into_region]]
+
+        landuse = self.landuse.ravel()[cells[first]]
+        frame = pd.DataFrame({
+            "name": names,
+            "center_x": weighted(x),
+            "center_y": weighted(y),
+            "elevation": weighted(self.elevation.ravel()[cells].astype(float)),
+            "cell_size": np.sqrt(total),
+            "slope": weighted(self.slope.ravel()[cells]),
+            "area": total,
+            "flow_width": 0.7 * np.sqrt(total),  # Based on Krebs et al. (2014)
+            "landuse": landuse,
+            "outlet": outlet,
+            "cells": np.bincount(label, minlength=n),
+        })
+        for key, values in self.landuse_param_arrays(landuse).items():
+            frame[key] = values
+        return frame
 
     def set_catchment_properties(self, catchment_table):
         """
-        Assigns SWMM subcatchment and infiltration parameters to each cell based on landuse.
-        Matches cell.landuse to the 'landuse' column (index 0) in the table.
+        Assigns SWMM subcatchment and infiltration parameters per landuse code.
+        Matches the 'landuse' column (index 0) in the table to the landuse raster.
         """
         if not catchment_table or not hasattr(catchment_table, "df"):
             print("⚠️ No catchment property table provided or invalid format.")
             return
 
         df = catchment_table.df
+        ncols = min(df.shape[1], len(CATCHMENT_TABLE_COLUMNS))
+        table = df.iloc[:, :ncols].copy()
+        table.columns = CATCHMENT_TABLE_COLUMNS[:ncols]
 
-        for row in self.cells:
-            for cell in row:
-                if cell is None or cell.landuse == 0:
-                    continue
-
-                match = df[df.iloc[:, 0] == str(cell.landuse)]  # Match landuse code as string
-                if match.empty:
-                    continue
+        # Rows whose landuse code is not a number (e.g. repeated headers) are skipped
+        code = pd.to_numeric(table.pop("landuse"), errors="coerce")
+        table = table[code.notna()]
+        table.index = pd.Index(code[code.notna()].astype(np.int64), name="landuse")
+        table = table[~table.index.duplicated()]
 
-                props = match.iloc[0]
+        self.landuse_params = table.reindex(columns=LANDUSE_PARAMS).astype(object)
+        self._param_lut, self._param_values = compile_landuse_params(self.landuse_params)
 
-                # Assign required subcatchment properties
-                cell.imperv = float(props[1])
-                cell.S_imperv = props[2]
-                cell.N_imperv = props[3]
-                cell.S_perv = props[4]
-                cell.N_perv = props[5]
-                cell.pct_zero = props[6]
-                cell.raingage = props[7]
+        # Report landuse classes present in the model but missing from the table
+        landuse = self.active.gather(self.landuse)
+        if landuse.size and landuse.min() >= 0:
+            counts = np.bincount(landuse)
+            present = np.flatnonzero(counts)
+        else:
+            present, counts_present = np.unique(landuse, return_counts=True)
+            counts = dict(zip(present, counts_present))
+        present = present[present != LANDUSE["LANDUSE_NONE"]]
+        missing = present[~np.isin(present, self.landuse_params.index)]
 
-                # Optional fields (default if missing)
-                cell.hyd_con = props[8] if len(props) > 8 else "0.5"
-                cell.imdmax = props[9] if len(props) > 9 else "0.25"
-                cell.suction = props[10] if len(props) > 10 else "3.5"
-                cell.snow_pack = props[11] if len(props) > 11 else ""
-                cell.tag = props[12] if len(props) > 12 else ""
+        self.unknown_landuse = {int(c): int(counts[c]) for c in missing}
+        if self.unknown_landuse:
+            summary = ", ".join(f"{c} ({n} cells)" for c, n in self.unknown_landuse.items())
+            print(f"⚠️ Landuse codes missing from catchment property table, using defaults: {summary}")
 
 
 
@@ -194,3 +888,4 @@ class Grid:
 # grid = Grid(dem, flow, lu)
 # grid.compute_neighbors_and_slopes()
 # grid.route_by_flowdir()
+# grid.cell(10, 20)  # inspect a single cell
@@ -0,0 +1,294 @@
+# hydrology.py
+#
+# Array algorithms over D8 flow graphs. A flow graph is a flat int64 array
+# `downstream` holding, for every cell, the flat index of the cell it drains
+# to, or -1 for outlets and nodata.
+
+import heapq
+import tempfile
+import numpy as np
+from typing import List, Optional, Tuple
+from gis_to_swmm.definitions import D8_OFFSETS
+
+# Flood front entries held in the Python heap before the rest spill to sorted runs
+FLOOD_QUEUE_ENTRIES = 1 << 20
+
+
+def topological_levels(downstream: np.ndarray) -> List[np.ndarray]:
+    """
+    Order cells upstream-first with Kahn's algorithm on in-degree counts.
+
+    Returns a list of index arrays ("levels"). Every cell appears after all
+    cells draining into it, and cells within a level do not drain into each
+    other. Each cell is visited once, so the whole pass is O(n). Cells on a
+    flow cycle never reach in-degree 0 and are left out (see cycle_outlets).
+    """
+    n = downstream.size
+    has_ds = downstream >= 0
+    indegree = np.bincount(downstream[has_ds], minlength=n)
+
+    levels = []
+    frontier = np.flatnonzero(indegree == 0)
+    while frontier.size:
+        levels.append(frontier)
+        targets = downstream[frontier]
+        targets, counts = np.unique(targets[targets >= 0], return_counts=True)
+        indegree[targets] -= counts
+        frontier = targets[indegree[targets] == 0]
+    return levels
+
+
+def cycle_outlets(downstream: np.ndarray, levels: List[np.ndarray], key: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    The cell to cut on every flow cycle: the one with the smallest key
+    (e.g. elevation; ties and key=None go to the lowest index). Each cell
+    drains to at most one cell, so the cells missing from levels are
+    exactly the cycles. The minimum is spread around each cycle by pointer
+    doubling, O(m log m) for m cycle cells. Returns their indices.
+    """
+    on_cycle = np.ones(downstream.size, dtype=bool)
+    for level in levels:
+        on_cycle[level] = False
+    cells = np.flatnonzero(on_cycle)
+    if not cells.size:
+        return cells
+
+    order = np.lexsort((cells, key[cells])) if key is not None else np.arange(cells.size)
+    rank = np.empty(cells.size, dtype=np.int64)
+    rank[order] = np.arange(cells.size)
+    step = np.searchsorted(cells, downstream[cells])
+    low = rank.copy()
+    for _ in range(int(cells.size).bit_length()):
+        low = np.minimum(low, low[step])
+        step = step[step]
+    return cells[low == rank]
+
+
+def accumulate(downstream: np.ndarray, levels: List[np.ndarray], weights: np.ndarray) -> np.ndarray:
+    """Sum of weights over each cell and everything upstream of it."""
+    total = np.asarray(weights, dtype=float).copy()
+    for level in levels:
+        targets = downstream[level]
+        routed = targets >= 0
+        np.add.at(total, targets[routed], total[level[routed]])
+    return total
+
+
+def distance_to_target(
+    downstream: np.ndarray, levels: List[np.ndarray], step: np.ndarray, target: np.ndarray
+) -> np.ndarray:
+    """
+    Flow path length from each cell down to the first cell flagged in target
+    (0 for target cells). Cells whose path never reaches a target get NaN.
+    step holds the length of each cell's own step to its downstream cell.
+    """
+    length = np.full(downstream.size, np.nan)
+    length[target] = 0.0
+    for level in reversed(levels):
+        level = level[~target[level]]
+        targets = downstream[level]
+        routed = targets >= 0
+        length[level[routed]] = length[targets[routed]] + step[level[routed]]
+    return length
+
+
+def watershed_labels(downstream: np.ndarray, levels: List[np.ndarray], active: np.ndarray) -> np.ndarray:
+    """
+    Label every active cell with the watershed of the outlet it drains to.
+    Outlets (active cells without a downstream cell) are numbered 0..k-1 in
+    flat index order; inactive cells and cells on flow cycles get -1.
+    """
+    label = np.full(downstream.size, -1, dtype=np.int64)
+    outlets = np.flatnonzero(active & (downstream < 0))
+    label[outlets] = np.arange(outlets.size)
+    for level in reversed(levels):
+        targets = downstream[level]
+        routed = targets >= 0
+        label[level[routed]] = label[targets[routed]]
+    label[~active] = -1
+    return label
+
+
+def work_array(shape, dtype, scratch_dir: Optional[str]) -> np.ndarray:
+    """Uninitialized array, memory-mapped to an anonymous file under scratch_dir when given."""
+    if scratch_dir is None:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(tempfile.TemporaryFile(dir=scratch_dir, suffix=".dat"), dtype=dtype, mode="w+", shape=shape)
+
+
+def flood_seeds(valid: np.ndarray) -> np.ndarray:
+    """Valid cells on the grid edge or next to a nodata cell, where water can leave."""
+    nrows, ncols = valid.shape
+    outside = np.pad(~valid, 1, constant_values=True)
+    seeds = np.zeros(valid.shape, dtype=bool)
+    for dr, dc in D8_OFFSETS:
+        seeds |= outside[1 + dr:1 + dr + nrows, 1 + dc:1 + dc + ncols]
+    return seeds & valid
+
+
+def drain_seeds(filled: np.ndarray, direction: np.ndarray, valid: np.ndarray, seeds: np.ndarray):
+    """
+    Point each seed cell at its steepest strictly lower valid neighbor on
+    the filled surface (square cells). Seeds without one stay outlets (-1).
+    """
+    nrows, ncols = filled.shape
+    rows, cols = np.nonzero(seeds)
+    height = filled[rows, cols]
+    steepest = np.zeros(rows.size)
+    best = np.full(rows.size, -1, dtype=np.int8)
+    for k, (dr, dc) in enumerate(D8_OFFSETS):
+        r2, c2 = rows + dr, cols + dc
+        inside = np.flatnonzero((r2 >= 0) & (r2 < nrows) & (c2 >= 0) & (c2 < ncols))
+        r2, c2 = r2[inside], c2[inside]
+        drop = (height[inside] - filled[r2, c2]) / np.hypot(dr, dc)
+        lower = valid[r2, c2] & (drop > steepest[inside])
+        steepest[inside[lower]] = drop[lower]
+        best[inside[lower]] = k
+    direction[rows, cols] = best
+
+
+class _SpillQueue:
+    """
+    Overflow for the flood's heap of integer keys: past capacity entries the
+    larger half of the heap moves into sorted NumPy runs (memory-mapped
+    under scratch_dir), and the smallest half of the runs comes back once
+    the heap's top passes them. Keys are split into (level, cell) so runs
+    stay int64 whatever the key width.
+    """
+
+    def __init__(self, capacity: int, shift: int, scratch_dir: Optional[str]):
+        self.capacity = capacity
+        self.shift = shift
+        self.mask = (1 << shift) - 1
+        self.scratch_dir = scratch_dir
+        self.runs = []
+
+    def _run(self, level, cell):
+        run = work_array((2, len(level)), np.int64, self.scratch_dir)
+        run[0], run[1] = level, cell
+        return run
+
+    def head(self):
+        """Smallest key held in the runs, or None."""
+        if not self.runs:
+            return None
+        return min((int(run[0, 0]) << self.shift) | int(run[1, 0]) for run in self.runs)
+
+    def spill(self, heap: list):
+        heap.sort()  # a sorted list is still a heap
+        tail = heap[self.capacity // 2:]
+        del heap[self.capacity // 2:]
+        shift, mask = self.shift, self.mask
+        self.runs.append(self._run([k >> shift for k in tail], [k & mask for k in tail]))
+        return self.head()
+
+    def reload(self, heap: list):
+        runs = np.concatenate(self.runs, axis=1)
+        runs = runs[:, np.lexsort((runs[1], runs[0]))]
+        take = min(self.capacity // 2, runs.shape[1])
+        shift = self.shift
+        heap.extend((h << shift) | c for h, c in zip(runs[0, :take].tolist(), runs[1, :take].tolist()))
+        heapq.heapify(heap)
+        self.runs = [self._run(runs[0, take:], runs[1, take:])] if take < runs.shape[1] else []
+        return self.head()
+
+
+def _ordered_bits(filled: np.ndarray) -> np.ndarray:
+    """
+    Flip negative floats in place into an order-preserving signed integer
+    view (and back: the flip is its own inverse). In that view the next
+    float up is the next integer, and keys compare as plain ints.
+    """
+    bits = filled.view(np.int32 if filled.dtype.itemsize == 4 else np.int64)
+    flip = (1 << (8 * filled.dtype.itemsize - 1)) - 1
+    np.bitwise_xor(bits, flip, out=bits, where=bits < 0)
+    return bits
+
+
+def priority_flood(
+    elevation: np.ndarray, valid: np.ndarray, epsilon: bool = True, scratch_dir: Optional[str] = None,
+    max_queue: int = FLOOD_QUEUE_ENTRIES
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fill depressions with Priority-Flood (Barnes et al. 2014), O(n log n).
+
+    The flood starts from the cells where water can leave the grid and
+    always grows from the lowest open cell. A cell reached from a higher
+    neighbor is raised to that neighbor's level; with epsilon it is raised
+    one float step above, so filled pits and flats keep a drainable gradient.
+
+    Each cell also drains to the neighbor the flood reached it from, which
+    gives a D8 direction (index into D8_OFFSETS) for every cell without
+    depressions. Seed cells drain to their steepest lower neighbor (see
+    drain_seeds) and are outlets (-1) only when they have none.
+
+    Working memory is the filled copy, one byte of state and one byte of
+    direction per cell, plus at most max_queue heap entries of the flood
+    front; a longer front overflows into sorted runs (see _SpillQueue).
+    With scratch_dir the per-cell arrays and runs are memory-mapped files.
+    The flood is a Python loop over integer heap keys, about 4 s per
+    million cells on a random DEM.
+    """
+    nrows, ncols = elevation.shape
+    dtype = elevation.dtype if np.issubdtype(elevation.dtype, np.floating) else np.dtype(np.float64)
+
+    # A ring of closed cells around the grid spares bounds checks in the loop
+    width = ncols + 2
+    padded = (nrows + 2, width)
+    filled = work_array(padded, dtype, scratch_dir)
+    filled[:] = 0
+    filled[1:-1, 1:-1] = elevation
+    filled += 0  # -0.0 becomes 0.0, so one step up is always strictly higher
+    direction = work_array(padded, np.int8, scratch_dir)
+    direction[:] = -1
+    closed = work_array(padded, np.uint8, scratch_dir)
+    closed[:] = 1
+    closed[1:-1, 1:-1] = ~valid
+
+    seed_mask = flood_seeds(valid)
+    seeds = np.flatnonzero(np.pad(seed_mask, 1))
+    closed.ravel()[seeds] = 1
+
+    # Heap keys are level << shift | cell: one int compare orders by height, then cell
+    bits = _ordered_bits(filled)
+    shift = int(bits.size).bit_length()
+    mask = (1 << shift) - 1
+    step = 1 if epsilon else 0
+
+    # Memoryviews give fast scalar access without copying to Python lists
+    z = memoryview(bits.ravel())
+    done = memoryview(closed.ravel())
+    drains_to = memoryview(direction.ravel())
+    neighbors = [(dr * width + dc, D8_OFFSETS.index((-dr, -dc))) for dr, dc in D8_OFFSETS]
+
+    overflow = _SpillQueue(max(max_queue, 16), shift, scratch_dir)
+    heap = [(level << shift) | cell for level, cell in zip(bits.ravel()[seeds].tolist(), seeds.tolist())]
+    heapq.heapify(heap)
+    spilled = overflow.spill(heap) if len(heap) > overflow.capacity else None
+    heappush, heappop = heapq.heappush, heapq.heappop
+    capacity = overflow.capacity
+
+    while heap or spilled is not None:
+        if spilled is not None and (not heap or heap[0] > spilled):
+            spilled = overflow.reload(heap)
+        key = heappop(heap)
+        cell, level = key & mask, key >> shift
+        for offset, back in neighbors:
+            nb = cell + offset
+            if done[nb]:
+                continue
+            done[nb] = 1
+            drains_to[nb] = back
+
+            height = z[nb]
+            if height <= level:
+                height = level + step
+                z[nb] = height
+            heappush(heap, (height << shift) | nb)
+        if len(heap) > capacity:
+            spilled = overflow.spill(heap)
+
+    _ordered_bits(filled)
+    filled, direction = filled[1:-1, 1:-1], direction[1:-1, 1:-1]
+    drain_seeds(filled, direction, valid, seed_mask)
+    return filled, direction
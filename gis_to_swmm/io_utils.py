@@ -1,32 +1,250 @@
 # io_utils.py
 
 ##ASCII writer
+import gzip
+import io
+import itertools
+import mmap
+import os
+import re
+import shutil
+import tempfile
 import numpy as np
+import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Polygon
-from shapely.geometry import LineString
-from gis_to_swmm.cell import Cell
-from typing import List
+import rasterio
+from dataclasses import asdict
+import shapely
+from gis_to_swmm.definitions import LANDUSE, LAYER_PARAM_COLUMNS
+from gis_to_swmm.table import Table, write_rows
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+# Rows formatted per chunk by the .inp section writer
+INP_CHUNK_ROWS = 200_000
+WRITE_BUFFER_SIZE = 1 << 20
+# Formatted section text held in memory before spilling to a temporary file
+SECTION_SPOOL_SIZE = 64 << 20
+# Cells per batch appended by the vector layer writers
+EXPORT_CHUNK_ROWS = 250_000
+# Raster rows formatted per block by the ASCII grid writer
+ASCII_CHUNK_ROWS = 256
+GEOTIFF_BLOCK_SIZE = 256
+RASTER_FORMATS = ("asc", "tif")
+
+def cells_to_frame(cells) -> pd.DataFrame:
+    """
+    Normalize writer input to one DataFrame row per subcatchment. Accepts a
+    Grid, a DataFrame with Cell column names, or a list of Cell objects.
+    """
+    if isinstance(cells, pd.DataFrame):
+        return cells
+    if hasattr(cells, "to_frame"):
+        return cells.to_frame()
+    return pd.DataFrame([asdict(c) for c in cells])
+
+def iter_cell_frames(cells, chunk_rows: int = INP_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Yield writer input as DataFrame chunks of at most chunk_rows rows. A Grid
+    is flattened chunk by chunk over its active cells, so the full cell
+    table never exists at once.
+    """
+    if hasattr(cells, "to_frame") and not isinstance(cells, pd.DataFrame):
+        index = cells.active.flat
+        for start in range(0, index.size, chunk_rows):
+            yield cells.to_frame(index[start:start + chunk_rows])
+        return
+    frame = cells_to_frame(cells)
+    for start in range(0, len(frame), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows]
+
+def open_text_output(path):
+    """Open a text file for writing with a large buffer, gzip-compressed if path ends in .gz."""
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "wt", compresslevel=6)
+    return open(path, "w", buffering=WRITE_BUFFER_SIZE)
+
+def _format_rows(fmt: str, *columns) -> List[str]:
+    """Apply one printf-style format per row across whole columns."""
+    return list(map(fmt.__mod__, zip(*(np.asarray(c).tolist() for c in columns))))
+
+def _format_groups(frame: pd.DataFrame, columns: List[str], fmt: str) -> List[str]:
+    """
+    Format columns that repeat across many rows (landuse parameters) once
+    per distinct combination, then gather the text back to every row.
+    """
+    codes = frame.groupby(columns, sort=False, dropna=False).ngroup().to_numpy()
+    uniques = frame[columns].drop_duplicates()
+    text = np.array(_format_rows(fmt, *(uniques[c] for c in columns)), dtype=object)
+    return text[codes].tolist()
+
+def _join_lines(lines: List[str]) -> str:
+    return "\n".join(lines) + "\n" if lines else ""
+
+def format_subcatchments(frame: pd.DataFrame) -> str:
+    snow_pack = frame["snow_pack"].fillna("").astype(str).replace("", "-")
+    return _join_lines(_format_rows(
+        "%-16s%-10s%-10s%.4f  %6s  %6.2f  %6.2f  %6.2f  %s",
+        frame["name"], frame["raingage"], frame["outlet"], frame["area"] / 10000, frame["imperv"],
+        frame["flow_width"], frame["slope"] * 100, frame["cell_size"], snow_pack
+    ))
+
+def format_subareas(frame: pd.DataFrame) -> str:
+    columns = ["N_Imperv", "N_Perv", "S_Imperv", "S_Perv", "PctZero", "RouteTo", "PctRouted"]
+    params = _format_groups(frame, columns, "%-10s" * len(columns))
+    return _join_lines(_format_rows("%-16s%s", frame["name"], params))
+
+def format_infiltration(frame: pd.DataFrame) -> str:
+    columns = ["Suction", "HydCon", "IMDmax"]
+    params = _format_groups(frame, columns, "%-10s" * len(columns))
+    return _join_lines(_format_rows("%-16s%s", frame["name"], params))
+
+# The sections generated from the cells: (title, column comment, formatter)
+CELL_SECTIONS = [
+    ("SUBCATCHMENTS", ";;Subcatchment   Raingage  Outlet  Area  %Imperv  Width  %Slope  CurbLen  SnowPack",
+     format_subcatchments),
+    ("SUBAREAS", ";;Subcatchment   N-Imperv  N-Perv  S-Imperv  S-Perv  PctZero  RouteTo  PctRouted",
+     format_subareas),
+    ("INFILTRATION", ";;Subcatchment   Suction  HydCon  IMDmax", format_infiltration),
+]
+
+def spool_cell_sections(cells, chunk_rows: int = INP_CHUNK_ROWS) -> Dict[str, tempfile.SpooledTemporaryFile]:
+    """
+    Format the column comment and rows of every subcatchment section in one
+    pass over the cells: each chunk frame is built once and formatted into
+    one spool per section, held in memory up to SECTION_SPOOL_SIZE and then
+    spilled to a temporary file. Cells with landuse 0 are not subcatchments
+    and are skipped (a Grid never yields them, its chunks only cover the
+    active cells). The spools are returned rewound, by section title.
+    """
+    spools = {}
+    for title, header, _ in CELL_SECTIONS:
+        spools[title] = tempfile.SpooledTemporaryFile(SECTION_SPOOL_SIZE, mode="w+", encoding="utf-8", newline="")
+        spools[title].write(f"{header}\n")
+    for chunk in iter_cell_frames(cells, chunk_rows):
+        chunk = chunk[chunk["landuse"] != 0]
+        if len(chunk):
+            for title, _, formatter in CELL_SECTIONS:
+                spools[title].write(formatter(chunk))
+    for spool in spools.values():
+        spool.write("\n")
+        spool.seek(0)
+    return spools
+
+def copy_spool(f, spool):
+    """Copy a spooled section into the output and release it."""
+    with spool:
+        shutil.copyfileobj(spool, f, WRITE_BUFFER_SIZE)
+
+def _ascii_georeference(transform, nrows: int) -> str:
+    """ESRI ASCII header lines for a north-up transform, anchored at the lower-left corner."""
+    a, b, c, d, e, f = transform[:6]
+    if b != 0 or d != 0:
+        raise ValueError("ESRI ASCII grids need a north-up transform; write a GeoTIFF instead")
+    yll = f + e * nrows  # e is negative: the origin is the top-left corner
+    size = f"cellsize      {a}\n" if abs(a) == abs(e) else f"dx            {a}\ndy            {abs(e)}\n"
+    return f"xllcorner     {c}\nyllcorner     {yll}\n" + size
+
+def save_ascii_raster(path, array, transform, nodata=-9999, precision: int = 3,
+                      chunk_rows: int = ASCII_CHUNK_ROWS):
+    """
+    Write an ESRI ASCII grid. Integer arrays are written as integers, float
+    arrays with precision decimals; NaN cells get nodata. Rows are
+    formatted a block at a time, one format call per row.
+    """
+    array = np.asarray(array)
+    nrows, ncols = array.shape
+    is_float = np.issubdtype(array.dtype, np.floating)
+    spec = f"%.{precision}f" if is_float else "%d"
+    row_fmt = " ".join([spec] * ncols) + "\n"
+
+    with open_text_output(path) as f:
+        f.write(f"ncols         {ncols}\nnrows         {nrows}\n")
+        f.write(_ascii_georeference(transform, nrows))
+        f.write(f"NODATA_value  {nodata}\n")
+        for start in range(0, nrows, chunk_rows):
+            block = array[start:start + chunk_rows]
+            if is_float:
+                block = np.where(np.isnan(block), nodata, block)
+            f.write("".join(map(row_fmt.__mod__, map(tuple, block.tolist()))))
+
+def save_geotiff(path, array, transform, crs=None, nodata=None, compress: str = "deflate",
+                 blocksize: int = GEOTIFF_BLOCK_SIZE):
+    """
+    Write a single-band tiled, compressed GeoTIFF. Float arrays keep NaN
+    as nodata unless another value is given.
+    """
+    array = np.asarray(array)
+    is_float = np.issubdtype(array.dtype, np.floating)
+    if nodata is None and is_float:
+        nodata = np.nan
+    elif nodata is not None and is_float:
+        array = np.where(np.isnan(array), nodata, array)
 
-def save_ascii_raster(path, array, transform, nodata=-9999):
     nrows, ncols = array.shape
-    xll, yll = transform[2], transform[5]  # lower-left origin
-    cellsize = transform[0]
-
-    header = (
-        f"ncols         {ncols}\n"
-        f"nrows         {nrows}\n"
-        f"xllcorner     {xll}\n"
-        f"yllcorner     {yll}\n"
-        f"cellsize      {cellsize}\n"
-        f"NODATA_value  {nodata}\n"
+    profile = dict(
+        driver="GTiff", height=nrows, width=ncols, count=1, dtype=array.dtype,
+        crs=crs or None, transform=transform, nodata=nodata, compress=compress,
+        predictor=3 if is_float else 2,
     )
-
-    with open(path, "w") as f:
-        f.write(header)
-        for row in array:
-            row_fmt = " ".join(str(int(val)) if not np.isnan(val) else str(nodata) for val in row)
-            f.write(row_fmt + "\n")
+    # Tiles must be multiples of 16; small rasters are written in strips
+    if nrows >= blocksize and ncols >= blocksize:
+        profile.update(tiled=True, blockxsize=blocksize, blockysize=blocksize)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(array, 1)
+
+def grid_rasters(grid) -> dict:
+    """
+    Every per-cell array of a Grid as name -> (array, nodata). The input
+    layers keep every cell with an elevation; the model layers are spread
+    back from the active cells through the grid's index, with nodata
+    elsewhere. Integer layers use -1 (landuse 0).
+    """
+    valid, cells = grid.valid, grid.active
+
+    def floats(values, mask=None):
+        if values is None:
+            return None
+        if mask is None:
+            return cells.scatter(cells.gather(values).astype(float, copy=False), np.nan)
+        return np.where(mask, values, np.nan)
+
+    def ints(values, nodata=-1, mask=None):
+        if values is None:
+            return None
+        if mask is None:
+            return cells.scatter(cells.gather(values), nodata), nodata
+        return np.where(mask, values, nodata), nodata
+
+    layers = {
+        "elevation": (floats(grid.elevation, valid), -9999),
+        "slope": (floats(grid.slope), -9999),
+        "flowwidth": (floats(grid.flow_width), -9999),
+        "accumulation": (floats(grid.contributing_area), -9999),
+        "flowlength": (floats(grid.flow_length), -9999),
+        "cellid": (cells.dense.reshape(cells.shape), -1),
+        "outletid": ints(grid.outlet_id),
+        "flowdir": ints(grid.flowdir, mask=valid),
+        "landuse": ints(grid.landuse, LANDUSE["LANDUSE_NONE"], mask=valid),
+        "sink": ints(grid.is_sink),
+        "watershed": ints(grid.watershed),
+    }
+    return {name: layer for name, layer in layers.items() if layer is not None and layer[0] is not None}
+
+def save_grid_rasters(grid, prefix: str, fmt: str = "asc", layers=None, precision: int = 3):
+    """
+    Write the grid's per-cell arrays as {prefix}_{name}.asc (ESRI ASCII) or
+    .tif (tiled, compressed GeoTIFF). layers limits the output to some names.
+    """
+    if fmt not in RASTER_FORMATS:
+        raise ValueError(f"Unknown raster format '{fmt}', expected one of {RASTER_FORMATS}")
+    for name, (array, nodata) in grid_rasters(grid).items():
+        if layers is not None and name not in layers:
+            continue
+        path = f"{prefix}_{name}.{fmt}"
+        if fmt == "asc":
+            save_ascii_raster(path, array, grid.transform, nodata=nodata, precision=precision)
+        else:
+            save_geotiff(path, array, grid.transform, grid.crs, nodata=None if np.issubdtype(array.dtype, np.floating) else nodata)
 
 ##wkt writer for subcatchment polygons
 
@@ -40,31 +258,238 @@ def save_ascii_raster(path, array, transform, nodata=-9999):
 #             f.write(f"{i+1};{polygon};{cell.name};{cell.outlet};{cell.area};{cell.slope*100:.2f};"
 #                     f"{cell.elevation};{cell.landuse}\n")
 
-def save_subcatchments_geojson(path, cells: List['Cell']):
-    records = []
-
-    for i, cell in enumerate(cells):
-        x, y, s = cell.center_x, cell.center_y, 0.5 * cell.cell_size
-        poly = Polygon([
-            (x - s, y - s),
-            (x - s, y + s),
-            (x + s, y + s),
-            (x + s, y - s),
-            (x - s, y - s)
-        ])
-        records.append({
-            "id": i + 1,
-            "name": cell.name,
-            "outlet": cell.outlet,
-            "area_m2": cell.area,
-            "slope_pct": cell.slope * 100,
-            "elevation": cell.elevation,
-            "landuse": cell.landuse,
-            "geometry": poly
-        })
-
-    gdf = gpd.GeoDataFrame(records, crs="EPSG:4326")
-    gdf.to_file(path, driver="GeoJSON")
+def cell_polygons(frame: pd.DataFrame) -> np.ndarray:
+    """Square cell outlines for every row, built in one shapely call."""
+    x, y = frame["center_x"].to_numpy(), frame["center_y"].to_numpy()
+    s = 0.5 * frame["cell_size"].to_numpy()
+    return shapely.box(x - s, y - s, x + s, y + s, ccw=False)
+
+def flow_segments(frame: pd.DataFrame) -> np.ndarray:
+    """Two-point lines from each cell center to its outlet, built in bulk."""
+    coords = np.stack([
+        frame[["center_x", "center_y"]].to_numpy(dtype=float),
+        frame[["outlet_x", "outlet_y"]].to_numpy(dtype=float),
+    ], axis=1)
+    return shapely.linestrings(coords)
+
+# Vector layer formats by file extension. Columnar formats are written in
+# one go; the OGR ones are appended batch by batch.
+COLUMNAR_FORMATS = {".parquet": "parquet", ".feather": "feather", ".arrow": "feather"}
+OGR_DRIVERS = {".geojson": "GeoJSON", ".json": "GeoJSON", ".gpkg": "GPKG", ".fgb": "FlatGeobuf", ".shp": "ESRI Shapefile"}
+VECTOR_FORMATS = {
+    "geojson": ".geojson", "parquet": ".parquet", "feather": ".feather", "gpkg": ".gpkg", "fgb": ".fgb",
+}
+# Formats streamed in one write session, with the spatial index built at the end
+STREAMING_DRIVERS = {".gpkg": "GPKG", ".fgb": "FlatGeobuf"}
+STREAM_BATCH_ROWS = 100_000
+# pyogrio.write_arrow needs GDAL 3.8; older GDAL streams through fiona
+ARROW_WRITE_GDAL = (3, 8, 0)
+
+def write_frames(path, frames: Iterator[gpd.GeoDataFrame], crs=None, driver: str = "GeoJSON"):
+    """
+    Write GeoDataFrame batches to one file, appending after the first, so
+    only one batch of geometries is held in memory at a time.
+    """
+    mode = "w"
+    for gdf in frames:
+        gdf.to_file(path, driver=driver, mode=mode)
+        mode = "a"
+    if mode == "w":
+        gpd.GeoDataFrame(geometry=[], crs=crs).to_file(path, driver=driver)
+
+def _concat_frames(frames: Iterator[gpd.GeoDataFrame], crs=None) -> gpd.GeoDataFrame:
+    frames = list(frames)
+    if not frames:
+        return gpd.GeoDataFrame(geometry=[], crs=crs)
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs)
+
+def rebatch(frames: Iterator[pd.DataFrame], batch_rows: int) -> Iterator[pd.DataFrame]:
+    """Regroup frames of any size into frames of exactly batch_rows rows (the last may be shorter)."""
+    pending, count = [], 0
+    for frame in frames:
+        while len(frame):
+            take = frame.iloc[:batch_rows - count]
+            frame = frame.iloc[len(take):]
+            pending.append(take)
+            count += len(take)
+            if count == batch_rows:
+                yield pd.concat(pending) if len(pending) > 1 else pending[0]
+                pending, count = [], 0
+    if pending:
+        yield pd.concat(pending) if len(pending) > 1 else pending[0]
+
+def _geometry_type(gdf: gpd.GeoDataFrame) -> str:
+    # Single and multi parts of one type (e.g. dissolved polygons) are declared multi
+    types = set(gdf.geom_type.dropna().unique())
+    if len(types) == 1:
+        return types.pop()
+    multi = {t if t.startswith("Multi") else f"Multi{t}" for t in types}
+    return multi.pop() if len(multi) == 1 else "Unknown"
+
+# Multi geometry types, with the single part type they collect and its constructor
+MULTI_PARTS = {
+    "MultiPoint": (shapely.GeometryType.POINT, shapely.multipoints),
+    "MultiLineString": (shapely.GeometryType.LINESTRING, shapely.multilinestrings),
+    "MultiPolygon": (shapely.GeometryType.POLYGON, shapely.multipolygons),
+}
+
+def _as_multi(geometry: np.ndarray, geometry_type: str) -> np.ndarray:
+    """Wrap single parts into one-part multi geometries when the layer is declared multi."""
+    if geometry_type not in MULTI_PARTS:
+        return geometry
+    part, collect = MULTI_PARTS[geometry_type]
+    index = np.flatnonzero(shapely.get_type_id(geometry) == part)
+    if not index.size:
+        return geometry
+    geometry = geometry.copy()
+    geometry[index] = collect(geometry[index], indices=np.arange(index.size))
+    return geometry
+
+def stream_layer(path, frames: Iterator[gpd.GeoDataFrame], crs=None, layer: Optional[str] = None,
+                 batch_rows: int = STREAM_BATCH_ROWS, geometry_type: Optional[str] = None):
+    """
+    Write GeoDataFrame chunks to a GeoPackage or FlatGeobuf layer in one
+    write session, regrouped into batches of batch_rows features, so memory
+    stays at one batch whatever the total size. GDAL fills the spatial
+    index (GeoPackage R-tree, FlatGeobuf packed Hilbert R-tree) once, when
+    the layer is closed. The layer schema and geometry type come from the
+    first batch. Without pyarrow or GDAL >= 3.8 the batches go through
+    fiona instead.
+    """
+    ext = os.path.splitext(str(path))[1].lower()
+    driver = STREAMING_DRIVERS[ext]
+    layer = layer or os.path.splitext(os.path.basename(str(path)))[0]
+    batches = rebatch(frames, batch_rows)
+    first = next(batches, None)
+    if first is None:
+        gpd.GeoDataFrame(geometry=[], crs=crs).to_file(path, driver=driver, layer=layer)
+        return
+    crs = first.crs or crs
+    geometry_type = geometry_type or _geometry_type(first)
+    if os.path.exists(path):
+        os.remove(path)
+
+    try:
+        import pyarrow as pa
+        import pyogrio
+        from pyogrio import write_arrow
+    except ImportError:
+        pyogrio = None
+    # Checked up front: once write_arrow fails the consumed batches are gone
+    if pyogrio is None or pyogrio.__gdal_version__ < ARROW_WRITE_GDAL:
+        _stream_layer_fiona(path, first, batches, crs, layer, driver, geometry_type)
+        return
+
+    def wkb_frame(gdf):
+        table = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+        table["geometry"] = shapely.to_wkb(_as_multi(gdf.geometry.to_numpy(), geometry_type))
+        return table
+
+    def record_batches(gdf):
+        # Joined frames convert to chunked columns; combine them into one batch
+        table = pa.Table.from_pandas(wkb_frame(gdf), schema=schema, preserve_index=False)
+        return table.combine_chunks().to_batches(batch_rows)
+
+    schema = pa.Schema.from_pandas(wkb_frame(first), preserve_index=False)
+    schema = schema.set(
+        schema.get_field_index("geometry"),
+        schema.field("geometry").with_metadata({b"ARROW:extension:name": b"geoarrow.wkb"})
+    )
+    reader = pa.RecordBatchReader.from_batches(
+        schema, itertools.chain.from_iterable(record_batches(gdf) for gdf in itertools.chain([first], batches)))
+    write_arrow(
+        reader, path, layer=layer, driver=driver, geometry_name="geometry",
+        geometry_type=geometry_type, crs=_crs_string(crs)
+    )
+
+def _stream_layer_fiona(path, first, batches, crs, layer, driver, geometry_type):
+    import fiona
+    from geopandas.io.file import infer_schema
+
+    schema = infer_schema(first)
+    schema["geometry"] = geometry_type
+    with fiona.open(path, "w", driver=driver, schema=schema, crs=_crs_string(crs), layer=layer) as dst:
+        for gdf in itertools.chain([first], batches):
+            gdf = gdf.set_geometry(gpd.GeoSeries(
+                _as_multi(gdf.geometry.to_numpy(), geometry_type), index=gdf.index, crs=gdf.crs))
+            dst.writerecords(gdf.iterfeatures(na="null"))
+
+def _crs_string(crs) -> Optional[str]:
+    return crs.to_wkt() if hasattr(crs, "to_wkt") else (crs or None)
+
+def write_layer(path, layer: Union[gpd.GeoDataFrame, Iterator[gpd.GeoDataFrame]], crs=None):
+    """
+    Write a GeoDataFrame, or an iterator of batches, in the format given by
+    the file extension: GeoParquet or Feather (WKB geometry), GeoPackage or
+    FlatGeobuf (streamed, see stream_layer), or another OGR format such as
+    GeoJSON.
+    """
+    ext = os.path.splitext(str(path))[1].lower()
+    geometry_type = None
+    if isinstance(layer, gpd.GeoDataFrame):
+        geometry_type = _geometry_type(layer) if len(layer) else None
+        layer = [layer]
+    if ext in COLUMNAR_FORMATS:
+        gdf = _concat_frames(layer, crs)
+        if COLUMNAR_FORMATS[ext] == "parquet":
+            gdf.to_parquet(path, index=False)
+        else:
+            gdf.to_feather(path)
+    elif ext in STREAMING_DRIVERS:
+        stream_layer(path, iter(layer), crs, geometry_type=geometry_type)
+    else:
+        write_frames(path, layer, crs, driver=OGR_DRIVERS.get(ext, "GeoJSON"))
+
+def read_layer(source) -> gpd.GeoDataFrame:
+    """Load a layer from a path in any format write_layer produces; GeoDataFrames pass through."""
+    if isinstance(source, gpd.GeoDataFrame):
+        return source
+    fmt = COLUMNAR_FORMATS.get(os.path.splitext(str(source))[1].lower())
+    if fmt == "parquet":
+        return gpd.read_parquet(source)
+    if fmt == "feather":
+        return gpd.read_feather(source)
+    return gpd.read_file(source)
+
+def _layer_crs(cells, crs):
+    if crs is None:
+        crs = getattr(cells, "crs", None)
+    return crs or None
+
+def subcatchment_frames(cells, crs=None, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[gpd.GeoDataFrame]:
+    """
+    One square polygon per cell, yielded in batches. crs defaults to the
+    Grid's raster CRS; rows are numbered 1..n in cell order across batches.
+    The landuse parameters go along (LAYER_PARAM_COLUMNS), so a layer read
+    back from file still carries them into merge_to_cells.
+    """
+    crs = _layer_crs(cells, crs)
+    offset = 0
+    for chunk in iter_cell_frames(cells, chunk_rows):
+        yield gpd.GeoDataFrame({
+            "id": np.arange(offset + 1, offset + len(chunk) + 1),
+            "name": chunk["name"].to_numpy(),
+            "outlet": chunk["outlet"].to_numpy(),
+            "area_m2": chunk["area"].to_numpy(),
+            "slope_pct": chunk["slope"].to_numpy() * 100,
+            "elevation": chunk["elevation"].to_numpy(dtype=float),
+            "landuse": chunk["landuse"].to_numpy(),
+            **{col: chunk[key].to_numpy(dtype=float) for col, key in LAYER_PARAM_COLUMNS.items()},
+        }, geometry=cell_polygons(chunk), crs=crs)
+        offset += len(chunk)
+
+def subcatchments_frame(cells, crs=None) -> gpd.GeoDataFrame:
+    """All cell polygons as one GeoDataFrame, for handing to dissolve in process."""
+    return _concat_frames(subcatchment_frames(cells, crs), _layer_crs(cells, crs))
+
+def save_subcatchments(path, cells, crs=None, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Write the cell polygons of a Grid, cell table or ready GeoDataFrame."""
+    if isinstance(cells, gpd.GeoDataFrame):
+        write_layer(path, cells)
+    else:
+        write_layer(path, subcatchment_frames(cells, crs, chunk_rows), _layer_crs(cells, crs))
+
+save_subcatchments_geojson = save_subcatchments
 
 ##wkt writer for flow routes
 # def save_flowlines_wkt(path, cells: List[Cell]):
@@ -76,22 +501,33 @@ def save_subcatchments_geojson(path, cells: List['Cell']):
 #                 line = f"LINESTRING({cell.center_x} {cell.center_y}, {cell.outlet_x} {cell.outlet_y})"
 #                 f.write(f"{i+1};{line};{cell.name};{cell.outlet}\n")
 
-def save_flowlines_geojson(path, cells: List['Cell']):
-    flowlines = []
-
-    for i, cell in enumerate(cells):
+def flowline_frames(cells, crs=None, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[gpd.GeoDataFrame]:
+    """A line from each routed cell to its outlet, yielded in batches, in the raster CRS by default."""
+    crs = _layer_crs(cells, crs)
+    offset = 0
+    for chunk in iter_cell_frames(cells, chunk_rows):
         # Only create a flowline if there's a valid outlet
-        if cell.outlet_id != -1 and cell.outlet != "*":
-            line = LineString([(cell.center_x, cell.center_y), (cell.outlet_x, cell.outlet_y)])
-            flowlines.append({
-                "id": i + 1,
-                "from": cell.name,
-                "to": cell.outlet,
-                "geometry": line
-            })
-
-    gdf = gpd.GeoDataFrame(flowlines, crs="EPSG:4326")
-    gdf.to_file(path, driver="GeoJSON")
+        routed = ((chunk["outlet_id"] != -1) & (chunk["outlet"] != "*")).to_numpy()
+        lines = chunk[routed]
+        if len(lines):
+            yield gpd.GeoDataFrame({
+                "id": offset + 1 + np.flatnonzero(routed),
+                "from": lines["name"].to_numpy(),
+                "to": lines["outlet"].to_numpy(),
+            }, geometry=flow_segments(lines), crs=crs)
+        offset += len(chunk)
+
+def flowlines_frame(cells, crs=None) -> gpd.GeoDataFrame:
+    return _concat_frames(flowline_frames(cells, crs), _layer_crs(cells, crs))
+
+def save_flowlines(path, cells, crs=None, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Write the flowlines of a Grid, cell table or ready GeoDataFrame."""
+    if isinstance(cells, gpd.GeoDataFrame):
+        write_layer(path, cells)
+    else:
+        write_layer(path, flowline_frames(cells, crs, chunk_rows), _layer_crs(cells, crs))
+
+save_flowlines_geojson = save_flowlines
 
 # .inp writer for SWMM5
 def save_swmm_inp(
@@ -102,7 +538,11 @@ def save_swmm_inp(
     symbols=None, outfalls=None, pumps=None, pump_curves=None,
     dwf=None, patterns=None, losses=None, storage=None, xsections=None
 ):
-    with open(path, "w") as f:
+    # A Grid is streamed in chunks; anything else is normalized once
+    if not hasattr(cells, "to_frame") or isinstance(cells, pd.DataFrame):
+        cells = cells_to_frame(cells)
+
+    with open_text_output(path) as f:
         f.write("[TITLE]\n;; Created by gis-to-swmm\n\n")
 
         if header:
@@ -125,24 +565,9 @@ def save_swmm_inp(
             raingages.write_to_stream(f)
             f.write("\n")
 
-        f.write("[SUBCATCHMENTS]\n;;Subcatchment   Raingage  Outlet  Area  %Imperv  Width  %Slope  CurbLen  SnowPack\n")
-        for cell in cells:
-            if cell.landuse != 0:
-                f.write(f"{cell.name:<16}{cell.raingage:<10}{cell.outlet:<10}"
-                        f"{cell.area/10000:.4f}  {cell.imperv:>6}  {cell.flow_width:>6.2f}  "
-                        f"{cell.slope*100:>6.2f}  {cell.cell_size:>6.2f}  {cell.snow_pack or '-'}\n")
-        f.write("\n")
-
-        f.write("[SUBAREAS]\n;;Subcatchment   N-Imperv  N-Perv  S-Imperv  S-Perv  PctZero  RouteTo  PctRouted\n")
-        for cell in cells:
-            f.write(f"{cell.name:<16}{cell.N_Imperv:<10}{cell.N_Perv:<10}{cell.S_Imperv:<10}"
-                    f"{cell.S_Perv:<10}{cell.PctZero:<10}{cell.RouteTo:<10}{cell.PctRouted:<10}\n")
-        f.write("\n")
-
-        f.write("[INFILTRATION]\n;;Subcatchment   Suction  HydCon  IMDmax\n")
-        for cell in cells:
-            f.write(f"{cell.name:<16}{cell.Suction:<10}{cell.HydCon:<10}{cell.IMDmax:<10}\n")
-        f.write("\n")
+        for title, spool in spool_cell_sections(cells).items():
+            f.write(f"[{title}]\n")
+            copy_spool(f, spool)
 
         if snowpacks:
             f.write("[SNOWPACKS]\n")
@@ -221,3 +646,210 @@ def save_swmm_inp(
 
         f.write("[END]\n")
 
+
+
+# .inp reader for patching existing models
+
+# Section headers of a SWMM .inp file: "[NAME]" at the start of a line
+INP_SECTION_PATTERN = re.compile(rb"[ \t]*\[([^\]\r\n]+)\]")
+COPY_BLOCK_SIZE = 16 << 20
+
+# save_swmm_inp table arguments and the .inp sections they fill
+INP_TABLE_SECTIONS = {
+    "header": "OPTIONS", "evaporation": "EVAPORATION", "temperature": "TEMPERATURE",
+    "raingages": "RAINGAGES", "snowpacks": "SNOWPACKS", "junctions": "JUNCTIONS",
+    "outfalls": "OUTFALLS", "storage": "STORAGE", "conduits": "CONDUITS",
+    "xsections": "XSECTIONS", "losses": "LOSSES", "pumps": "PUMPS", "pump_curves": "CURVES",
+    "inflows": "INFLOWS", "timeseries": "TIMESERIES", "dwf": "DWF", "patterns": "PATTERNS",
+    "report": "REPORT", "symbols": "SYMBOLS",
+}
+
+def scan_inp_sections(path) -> List[Tuple[str, int, int, int]]:
+    """
+    Find every section of an .inp file in one pass over a memory map,
+    jumping between '[' bytes. Returns (NAME, header offset, body offset,
+    end offset) per section.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    found = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = mm.find(b"[")
+        while pos >= 0:
+            line_start = mm.rfind(b"\n", 0, pos) + 1
+            line_end = mm.find(b"\n", pos)
+            line_end = size if line_end < 0 else line_end + 1
+            # A header is "[NAME]" with only blanks before it on its line
+            if not mm[line_start:pos].strip():
+                match = INP_SECTION_PATTERN.match(mm[line_start:line_end])
+                if match:
+                    found.append((match.group(1).strip().upper().decode("ascii", "replace"), line_start, line_end))
+            pos = mm.find(b"[", line_end)
+    ends = [start for _, start, _ in found[1:]] + [size]
+    return [(name, start, body, end) for (name, start, body), end in zip(found, ends)]
+
+def parse_inp_section(text: str) -> pd.DataFrame:
+    """
+    Split the data lines of a section on whitespace, dropping ';' comments.
+    Values stay strings; ragged rows are padded with None. Columns are named
+    from the first ';;' comment line when it has one name per column.
+    """
+    rows, names = [], None
+    for line in text.splitlines():
+        data = line.split(";", 1)[0].split()
+        if data:
+            rows.append(data)
+        elif names is None and line.lstrip().startswith(";;"):
+            names = line.lstrip()[2:].split()
+    df = pd.DataFrame(rows)
+    if names and len(names) == df.shape[1] and not names[0].startswith("-"):
+        df.columns = names
+    return df
+
+def _copy_range(src, dst, start: int, end: int):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = src.read(min(COPY_BLOCK_SIZE, remaining))
+        if not block:
+            break
+        dst.write(block)
+        remaining -= len(block)
+
+class InpSection(Table):
+    """
+    One section of an InpFile, usable wherever a Table is. The text is only
+    read, and parsed into .df, on first use. An untouched section is written
+    back exactly as it was; assign .df to write a new table instead.
+    """
+
+    def __init__(self, inp: "InpFile", name: str):
+        self.inp = inp
+        self.name = name
+        self.section = None
+        self._df = None
+        self.modified = False
+
+    @property
+    def text(self) -> str:
+        return self.inp.read_section(self.name).decode(self.inp.encoding)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        if self._df is None:
+            self._df = parse_inp_section(self.text)
+        return self._df
+
+    @df.setter
+    def df(self, value: pd.DataFrame):
+        self._df = value
+        self.modified = True
+
+    def write_to_stream(self, stream):
+        if not self.modified:
+            stream.write(self.text)
+            return
+        if isinstance(self._df.columns[0], str):
+            stream.write(";;" + "\t".join(map(str, self._df.columns)) + "\n")
+        write_rows(stream, self._df, na_rep="")
+
+class InpFile:
+    """
+    Section index of an existing SWMM .inp file. Sections are located in one
+    scan and read on demand, so even very large models open instantly;
+    rewrite() replaces chosen sections and copies all others byte for byte.
+    """
+
+    def __init__(self, path: str, encoding: str = "utf-8"):
+        self.path = path
+        self.encoding = encoding
+        self.offsets = scan_inp_sections(path)
+        self._index = {}
+        for name, start, body, end in self.offsets:
+            self._index.setdefault(name, (start, body, end))
+
+    @property
+    def sections(self) -> List[str]:
+        return [name for name, _, _, _ in self.offsets]
+
+    def __contains__(self, name: str) -> bool:
+        return name.upper() in self._index
+
+    def __getitem__(self, name: str) -> InpSection:
+        if name not in self:
+            raise KeyError(f"Section [{name.upper()}] not found in {self.path}")
+        return InpSection(self, name.upper())
+
+    def read_section(self, name: str) -> bytes:
+        """Raw body of a section, without its header line."""
+        _, body, end = self._index[name.upper()]
+        with open(self.path, "rb") as f:
+            f.seek(body)
+            return f.read(end - body)
+
+    def _write_content(self, out, content):
+        text = io.TextIOWrapper(out, encoding=self.encoding, newline="")
+        if callable(content):
+            content(text)
+        elif isinstance(content, InpSection) and not content.modified:
+            text.write(content.text)
+        elif hasattr(content, "write_to_stream"):
+            content.write_to_stream(text)
+            text.write("\n")
+        else:
+            text.write(str(content))
+        text.flush()
+        text.detach()
+
+    def rewrite(self, path: str, sections: Dict[str, object]):
+        """
+        Write a copy of the file to path with the given sections replaced.
+        Values are Tables (anything with write_to_stream), strings, or
+        callables writing the section body to a text stream. Sections not in
+        the file are appended at the end; path may be the file itself.
+        """
+        replace = {name.upper(): content for name, content in sections.items()}
+        tmp = f"{path}.tmp"
+        opener = gzip.open if str(path).endswith(".gz") else open
+        first = self.offsets[0][1] if self.offsets else os.path.getsize(self.path)
+
+        new = [name for name in replace if name not in self._index]
+
+        def append_new():
+            while new:
+                name = new.pop(0)
+                out.write(f"[{name}]\n".encode(self.encoding))
+                self._write_content(out, replace[name])
+
+        with open(self.path, "rb") as src, opener(tmp, "wb") as out:
+            _copy_range(src, out, 0, first)
+            done = set()
+            for name, start, body, end in self.offsets:
+                if name == "END":
+                    append_new()  # new sections go before a closing [END]
+                if name not in replace:
+                    _copy_range(src, out, start, end)
+                elif name not in done:
+                    _copy_range(src, out, start, body)
+                    self._write_content(out, replace[name])
+                    done.add(name)
+            append_new()
+        os.replace(tmp, path)
+
+def patch_swmm_inp(base_path: str, path: str, cells, tables: Optional[Dict[str, object]] = None):
+    """
+    Regenerate the subcatchment sections of an existing model: copy
+    base_path to path with SUBCATCHMENTS, SUBAREAS and INFILTRATION written
+    from the cells, plus any tables given by section name. Every other
+    section passes through unchanged.
+    """
+    if not hasattr(cells, "to_frame") or isinstance(cells, pd.DataFrame):
+        cells = cells_to_frame(cells)
+
+    def section_writer(spool):
+        return lambda f: copy_spool(f, spool)
+
+    sections = {title: section_writer(spool) for title, spool in spool_cell_sections(cells).items()}
+    sections.update(tables or {})
+    InpFile(base_path).rewrite(path, sections)
@@ -3,53 +3,101 @@
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-from shapely.geometry import Polygon
-from shapely.ops import unary_union
-from gis_to_swmm.cell import Cell
-from typing import List
+import shapely
+from gis_to_swmm.definitions import LAYER_PARAM_COLUMNS
+from gis_to_swmm.dissolve import grid_squares
+from gis_to_swmm.grid import LANDUSE_PARAMS, default_landuse_params
+from gis_to_swmm.io_utils import read_layer
 
-def merge_to_cells(merged_gpkg: str, original_shp: str) -> List[Cell]:
+def overlay_pieces(merged: gpd.GeoDataFrame, original: gpd.GeoDataFrame):
     """
-    Merges dissolved polygons back into SWMM-compatible Cell objects
-    using area-weighted averaging of attributes.
+    (merged row, original row, intersection area) of every overlapping pair,
+    from one bulk join. Cell squares lie wholly inside the polygon they were
+    dissolved into, so they are looked up by their center; other layers are
+    intersected in a single indexed overlay.
     """
-    merged = gpd.read_file(merged_gpkg)
-    original = gpd.read_file(original_shp)
-
-    merged_cells = []
-
-    for _, poly in merged.iterrows():
-        intersected = gpd.overlay(original, gpd.GeoDataFrame(geometry=[poly.geometry], crs=original.crs), how='intersection')
-        if intersected.empty:
-            continue
-
-        # Add area (m²)
-        intersected['intersect_area'] = intersected.geometry.area
-
-        # Weighted averages
-        def weighted_avg(col):
-            return np.average(intersected[col], weights=intersected['intersect_area'])
-
-        elevation = weighted_avg("elevation")
-        slope = weighted_avg("slope_pct") / 100.0
-        area = intersected['intersect_area'].sum()
-        landuse = int(intersected['landuse'].mode().iloc[0])
-        outlet = intersected['outlet'].mode().iloc[0]
-
-        centroid = poly.geometry.centroid
-        cell = Cell(
-            name=f"sc{len(merged_cells)+1}",
-            center_x=centroid.x,
-            center_y=centroid.y,
-            elevation=elevation,
-            slope=slope,
-            area=area,
-            landuse=landuse,
-            outlet=outlet,
-            cell_size=np.sqrt(area),
-            flow_width=0.7 * np.sqrt(area)  # Based on Krebs et al. (2014)
-        )
-
-        merged_cells.append(cell)
-
-    return merged_cells
+    geometry = original.geometry.to_numpy()
+    if grid_squares(geometry) is not None:
+        tree = shapely.STRtree(merged.geometry.to_numpy())
+        row, poly = tree.query(shapely.centroid(geometry), predicate="within")
+        row, first = np.unique(row, return_index=True)
+        return poly[first], row, shapely.area(geometry[row])
+
+    left = gpd.GeoDataFrame({"row": np.arange(len(original))}, geometry=geometry, crs=original.crs)
+    right = gpd.GeoDataFrame({"poly": np.arange(len(merged))}, geometry=merged.geometry.to_numpy(), crs=original.crs)
+    pieces = gpd.overlay(left, right, how="intersection", keep_geom_type=True)
+    area = pieces.geometry.area.to_numpy()
+    keep = area > 0
+    return pieces["poly"].to_numpy()[keep], pieces["row"].to_numpy()[keep], area[keep]
+
+def _modal(poly: np.ndarray, values: np.ndarray, weight: np.ndarray) -> pd.Series:
+    # Value covering the largest area per polygon, the smallest on ties
+    frame = pd.DataFrame({"poly": poly, "value": values, "weight": weight})
+    totals = frame.groupby(["poly", "value"], sort=True, dropna=False)["weight"].sum().reset_index()
+    totals = totals.sort_values(["poly", "weight"], ascending=[True, False], kind="stable")
+    return totals.drop_duplicates("poly").set_index("poly")["value"]
+
+def merge_to_cells(merged_gpkg, original_shp, grid=None) -> pd.DataFrame:
+    """
+    Merges dissolved polygons back into SWMM-ready subcatchment rows (Cell
+    columns): area-weighted elevation and slope, and the landuse and outlet
+    covering most of each polygon. A merged layer with name and outlet
+    columns keeps its own outlets, renamed to sc1..scN. Subcatchment parameters are carried from
+    matching columns of the original layer, else looked up for the landuse
+    in grid's catchment table. Both layers may be paths or GeoDataFrames
+    handed over in process.
+    """
+    merged = read_layer(merged_gpkg)
+    original = read_layer(original_shp)
+
+    poly, row, weight = overlay_pieces(merged, original)
+    n = len(merged)
+    total = np.bincount(poly, weights=weight, minlength=n)
+    present = np.flatnonzero(total > 0)
+    total = total[present]
+
+    def weighted(col):
+        values = original[col].to_numpy(dtype=float)[row]
+        return np.bincount(poly, weights=weight * values, minlength=n)[present] / total
+
+    def modal(values):
+        return _modal(poly, values[row], weight).reindex(present).to_numpy()
+
+    centroid = shapely.centroid(merged.geometry.to_numpy()[present])
+    landuse = modal(original["landuse"].to_numpy()).astype(int)
+    frame = pd.DataFrame({
+        "name": np.char.add("sc", np.arange(1, present.size + 1).astype(str)).astype(object),
+        "center_x": shapely.get_x(centroid),
+        "center_y": shapely.get_y(centroid),
+        "elevation": weighted("elevation"),
+        "slope": weighted("slope_pct") / 100.0,
+        "area": total,
+        "landuse": landuse,
+        "outlet": modal(original["outlet"].to_numpy()),
+        "cell_size": np.sqrt(total),
+        "flow_width": 0.7 * np.sqrt(total),  # Based on Krebs et al. (2014)
+    })
+
+    if "name" in merged and "outlet" in merged:
+        # Layers that name their regions (adaptive_dissolve) already route
+        # region to region; keep those outlets under the new names
+        renamed = np.full(n, None, dtype=object)
+        renamed[present] = frame["name"].to_numpy()
+        outlet = merged["outlet"].to_numpy(dtype=object)[present]
+        target = pd.Index(merged["name"].to_numpy(dtype=object)).get_indexer(outlet)
+        into_region = target >= 0
+        outlet[into_region] = renamed[target[into_region]]
+        frame["outlet"] = outlet
+
+    params = grid.landuse_param_arrays(landuse) if grid is not None else {}
+    columns = {key: key for key in LANDUSE_PARAMS}
+    columns.update({col: key for col, key in LAYER_PARAM_COLUMNS.items() if key not in original})
+    for col, key in columns.items():
+        if col in original:
+            params[key] = modal(original[col].to_numpy())
+    if grid is None and not any(col in original for col in LAYER_PARAM_COLUMNS):
+        print(f"⚠️ Subcatchment layer has none of {list(LAYER_PARAM_COLUMNS)} and no grid was given, "
+              "using default landuse parameters")
+    for key, default in default_landuse_params().items():
+        frame[key] = params.get(key, default)
+    return frame
@@ -1,7 +1,33 @@
 # raster.py
+import os
+import tempfile
 import rasterio
 import numpy as np
 from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, Optional, Tuple
+from rasterio.coords import BoundingBox
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.warp import reproject
+from rasterio.windows import Window, from_bounds
+from gis_to_swmm.cache import cache_configured, cache_path, digest, publish, stat_digest
+
+# Rows read per strip when streaming into a memory-mapped array
+READ_BLOCK_ROWS = 1024
+
+
+def valid_mask(array: np.ndarray, nodata) -> np.ndarray:
+    """True where the array holds data, False for nodata/NaN."""
+    if np.issubdtype(array.dtype, np.floating):
+        mask = ~np.isnan(array)
+        if nodata is not None and not np.isnan(nodata):
+            mask &= array != nodata
+        return mask
+    if nodata is None or np.isnan(nodata):
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
 
 @dataclass
 class Raster:
@@ -13,29 +39,268 @@ class Raster:
     height: int
     resolution: float
     bounds: tuple
+    mask: Optional[np.ndarray] = None  # True where array holds data
+
+    def __post_init__(self):
+        if self.mask is None:
+            self.mask = valid_mask(self.array, self.nodata)
 
     @classmethod
-    def from_file(cls, path: str):
+    def from_file(
+        cls, path: str,
+        window: Optional[Window] = None,
+        bounds: Optional[Tuple[float, float, float, float]] = None,
+        rows: Optional[Tuple[int, int]] = None,
+        scratch_dir: Optional[str] = None
+    ):
+        """
+        Read band 1 in its native dtype, with nodata kept as a separate mask.
+
+        Only part of the raster is read when a window, a (left, bottom,
+        right, top) bounding box or a (start, stop) row block is given. With
+        scratch_dir the array is backed by a memory-mapped temporary file
+        there and filled strip by strip, so it never has to fit in RAM.
+        """
         with rasterio.open(path) as src:
-            array = src.read(1).astype(float)
+            if bounds is not None:
+                window = from_bounds(*bounds, transform=src.transform)
+            elif rows is not None:
+                window = Window(0, rows[0], src.width, rows[1] - rows[0])
+            if window is None:
+                window = Window(0, 0, src.width, src.height)
+            window = window.round_offsets().round_lengths().intersection(
+                Window(0, 0, src.width, src.height))
+
+            height, width = int(window.height), int(window.width)
+            dtype = np.dtype(src.dtypes[0])
             nodata = src.nodata if src.nodata is not None else np.nan
-            array[array == nodata] = np.nan
+
+            if scratch_dir is None:
+                array = src.read(1, window=window)
+                mask = valid_mask(array, nodata)
+            else:
+                scratch = tempfile.TemporaryFile(dir=scratch_dir, suffix=".dat")
+                array = np.memmap(scratch, dtype=dtype, mode="w+", shape=(height, width))
+                mask = np.empty((height, width), dtype=bool)
+                for start in range(0, height, READ_BLOCK_ROWS):
+                    stop = min(start + READ_BLOCK_ROWS, height)
+                    strip = Window(window.col_off, window.row_off + start, width, stop - start)
+                    src.read(1, window=strip, out=array[start:stop])
+                    mask[start:stop] = valid_mask(array[start:stop], nodata)
+
             return cls(
                 array=array,
-                transform=src.transform,
+                transform=src.window_transform(window),
                 crs=src.crs.to_string() if src.crs else "",
                 nodata=nodata,
-                width=src.width,
-                height=src.height,
+                width=width,
+                height=height,
                 resolution=src.res[0],
-                bounds=src.bounds
+                bounds=BoundingBox(*src.window_bounds(window)),
+                mask=mask
             )
 
+    def filled(self, value=np.nan) -> np.ndarray:
+        """Float copy of the array with nodata cells set to value."""
+        return np.where(self.mask, self.array, value).astype(float, copy=False)
+
+    @cached_property
+    def _center_terms(self):
+        """
+        Cell center coordinates split into a per-column and a per-row term,
+        x = x_col[col] + x_row[row] and y = y_col[col] + y_row[row]. The
+        split is exact for any affine transform, rotated ones included.
+        """
+        a, b, c, d, e, f = self.transform[:6]
+        cols = np.arange(self.width) + 0.5
+        rows = np.arange(self.height) + 0.5
+        return a * cols + c, b * rows, d * cols, e * rows + f
+
+    @property
+    def is_rectilinear(self) -> bool:
+        """True for north-up transforms, where x depends only on the column and y only on the row."""
+        return self.transform.b == 0 and self.transform.d == 0
+
+    @property
+    def x_centers(self) -> np.ndarray:
+        """Center x per column (add the per-row term for rotated rasters)."""
+        return self._center_terms[0]
+
+    @property
+    def y_centers(self) -> np.ndarray:
+        """Center y per row (add the per-column term for rotated rasters)."""
+        return self._center_terms[3]
+
+    def centers(self, rows, cols):
+        """Center coordinates for arrays of row and column indices."""
+        x_col, x_row, y_col, y_row = self._center_terms
+        return x_col[cols] + x_row[rows], y_col[cols] + y_row[rows]
+
+    def center_grids(self):
+        """
+        Full (height, width) center coordinate arrays. For north-up rasters
+        these are read-only broadcast views of the 1-D vectors.
+        """
+        x_col, x_row, y_col, y_row = self._center_terms
+        shape = (self.height, self.width)
+        if self.is_rectilinear:
+            return np.broadcast_to(x_col, shape), np.broadcast_to(y_row[:, None], shape)
+        return x_col[None, :] + x_row[:, None], y_col[None, :] + y_row[:, None]
+
     def get_value_at(self, row: int, col: int) -> float:
-        if 0 <= row < self.height and 0 <= col < self.width:
+        if 0 <= row < self.height and 0 <= col < self.width and self.mask[row, col]:
             return self.array[row, col]
         return np.nan
 
     def get_coords(self, row: int, col: int):
-        x, y = rasterio.transform.xy(self.transform, row, col, offset='center')
-        return x, y
+        x, y = self.centers(row, col)
+        return float(x), float(y)
+
+
+def _same_crs(a, b) -> bool:
+    # A layer without a CRS is assumed to share the DEM's
+    if not a or not b:
+        return True
+    return CRS.from_user_input(a) == CRS.from_user_input(b)
+
+
+def _aligned_window(src, target: Raster, tol: float = 1e-6) -> Optional[Window]:
+    """
+    Window of src covering exactly the target grid, or None when src is on
+    a different grid (CRS, pixel size, rotation or sub-pixel offset) or
+    does not cover the whole target.
+    """
+    if not _same_crs(src.crs.to_string() if src.crs else "", target.crs):
+        return None
+    src_t, dst_t = src.transform, target.transform
+    if any(abs(src_t[i] - dst_t[i]) > tol * abs(dst_t.a) for i in (0, 1, 3, 4)):
+        return None
+    if not target.is_rectilinear:
+        # Rotated grids only line up when they are the same grid
+        same = src_t.almost_equals(dst_t) and (src.height, src.width) == (target.height, target.width)
+        return Window(0, 0, src.width, src.height) if same else None
+
+    window = from_bounds(*target.bounds, transform=src.transform)
+    offsets = (window.col_off, window.row_off, window.width, window.height)
+    if any(abs(v - round(v)) > tol for v in offsets):
+        return None
+    window = window.round_offsets().round_lengths()
+    if (window.col_off < 0 or window.row_off < 0
+            or window.col_off + window.width > src.width or window.row_off + window.height > src.height):
+        return None
+    return window
+
+
+def _default_nodata(dtype: np.dtype):
+    if np.issubdtype(dtype, np.floating):
+        return np.nan
+    return np.iinfo(dtype).max
+
+
+def resample_to(path: str, target: Raster, scratch_dir: Optional[str] = None,
+                use_cache: Optional[bool] = None) -> Raster:
+    """
+    Nearest-neighbour reproject band 1 of path onto the target raster's
+    grid (CRS, transform and shape), as is right for categorical layers.
+    With the cache (by default only when GIS_TO_SWMM_CACHE is set) the
+    result is kept as a GeoTIFF keyed by the source content hash and the
+    target grid, so repeated runs skip the warp; the source is only hashed
+    again when its size or modification time changes. With scratch_dir the
+    warp writes into a memory-mapped temporary file.
+    """
+    if use_cache is None:
+        use_cache = cache_configured()
+    cached = None
+    if use_cache:
+        grid_key = (target.crs, tuple(target.transform[:6]), target.width, target.height)
+        cached = cache_path("aligned", digest(stat_digest(path), grid_key), ".tif")
+    if cached and os.path.exists(cached):
+        print(f"♻️ Using cached resampled layer {cached}")
+        return Raster.from_file(cached, scratch_dir=scratch_dir)
+
+    with rasterio.open(path) as src:
+        dtype = np.dtype(src.dtypes[0])
+        nodata = src.nodata if src.nodata is not None else _default_nodata(dtype)
+        shape = (target.height, target.width)
+        if scratch_dir is None:
+            array = np.full(shape, nodata, dtype=dtype)
+        else:
+            scratch = tempfile.TemporaryFile(dir=scratch_dir, suffix=".dat")
+            array = np.memmap(scratch, dtype=dtype, mode="w+", shape=shape)
+            array[:] = nodata
+        reproject(
+            source=rasterio.band(src, 1),
+            destination=array,
+            src_nodata=src.nodata,
+            dst_transform=target.transform,
+            dst_crs=target.crs or src.crs,
+            dst_nodata=nodata,
+            resampling=Resampling.nearest,
+        )
+        crs = src.crs
+
+    if use_cache:
+        tmp = cached + ".tmp"
+        profile = dict(
+            driver="GTiff", height=target.height, width=target.width, count=1, dtype=dtype,
+            crs=target.crs or crs, transform=target.transform, nodata=nodata,
+            tiled=True, compress="deflate",
+        )
+        with rasterio.open(tmp, "w", **profile) as dst:
+            dst.write(array, 1)
+        publish(tmp, cached)
+
+    return Raster(
+        array=array,
+        transform=target.transform,
+        crs=target.crs,
+        nodata=nodata,
+        width=target.width,
+        height=target.height,
+        resolution=target.resolution,
+        bounds=target.bounds,
+    )
+
+
+class RasterStack:
+    """
+    A DEM plus layers (flow direction, landuse, ...) guaranteed to share its
+    shape, transform and CRS. Layers on the DEM grid are read through a
+    window; any other layer is resampled onto it with nearest neighbour.
+    """
+
+    def __init__(self, dem: Raster, layers: Dict[str, Optional[Raster]]):
+        for name, layer in layers.items():
+            if layer is not None and layer.array.shape != dem.array.shape:
+                raise ValueError(f"Layer '{name}' has shape {layer.array.shape}, DEM has {dem.array.shape}")
+        self.dem = dem
+        self.layers = layers
+
+    def __getitem__(self, name: str) -> Optional[Raster]:
+        return self.layers[name]
+
+    @classmethod
+    def from_files(
+        cls, dem_path: str, layers: Dict[str, Optional[str]],
+        bounds: Optional[Tuple[float, float, float, float]] = None,
+        scratch_dir: Optional[str] = None,
+        use_cache: Optional[bool] = None
+    ) -> "RasterStack":
+        dem = Raster.from_file(dem_path, bounds=bounds, scratch_dir=scratch_dir)
+
+        loaded = {}
+        for name, path in layers.items():
+            if path is None:
+                loaded[name] = None
+                continue
+
+            with rasterio.open(path) as src:
+                window = _aligned_window(src, dem)
+
+            if window is not None:
+                loaded[name] = Raster.from_file(path, window=window, scratch_dir=scratch_dir)
+            else:
+                print(f"🔁 Layer '{name}' is not on the DEM grid, aligning it (nearest neighbour)...")
+                loaded[name] = resample_to(path, dem, scratch_dir=scratch_dir, use_cache=use_cache)
+
+        return cls(dem, loaded)
@@ -2,24 +2,30 @@
 
 import os
 import datetime
+import numpy as np
 from typing import List
-from shapely.geometry import box
 import geopandas as gpd
 
 from gis_to_swmm.merge import merge_to_cells
 from gis_to_swmm.cell import Cell
-from gis_to_swmm.raster import Raster
+from gis_to_swmm.raster import RasterStack
 from gis_to_swmm.grid import Grid
 from gis_to_swmm.table import parse_junctions
-from gis_to_swmm.dissolve import dissolve_subcatchments_geojson
+from gis_to_swmm.dissolve import dissolve_subcatchments, dissolve_raster, adaptive_dissolve
 from gis_to_swmm.io_utils import (
-    save_subcatchments_geojson, save_flowlines_geojson, save_ascii_raster,
-    save_swmm_inp
+    save_subcatchments, save_flowlines, subcatchments_frame, flowlines_frame,
+    save_grid_rasters, save_swmm_inp, patch_swmm_inp, INP_TABLE_SECTIONS, cells_to_frame, cell_polygons, VECTOR_FORMATS
 )
 
 def run_model(
     dem_path, flowdir_path, landuse_path, output_dir,
-    run_dissolve=False,
+    run_dissolve=False, slope_method="d8", flowdir_encoding="grass",
+    bounds=None, scratch_dir=None,
+    junction_landuse=None, junction_max_distance=None, fill_sinks=False,
+    vector_format="geojson", dissolve_method="vector",
+    raster_format="asc", raster_precision=3, base_inp=None, dissolve_workers=1, dissolve_tile=None,
+    max_subcatchments=None, min_subcatchment_area=None, max_subcatchment_area=None,
+    max_slope_std=None, merge_priority="area",
     junctions=None, conduits=None,
     header=None, catchment_props=None, evaporation=None, temperature=None,
     inflows=None, timeseries=None, report=None, snowpacks=None, raingages=None,
@@ -27,35 +33,55 @@ def run_model(
     dwf=None, patterns=None, losses=None, storage=None, xsections=None
 ):
 
-    # Load rasters
-    dem = Raster.from_file(dem_path)
-    flowdir = Raster.from_file(flowdir_path)
-    landuse = Raster.from_file(landuse_path)
+    # Load rasters (optionally clipped to bounds and memory-mapped), with
+    # flowdir and landuse aligned onto the DEM grid
+    stack = RasterStack.from_files(
+        dem_path, {"flowdir": flowdir_path, "landuse": landuse_path},
+        bounds=bounds, scratch_dir=scratch_dir
+    )
+    dem, flowdir, landuse = stack.dem, stack["flowdir"], stack["landuse"]
 
     # Build grid
-    grid = Grid(dem, flowdir, landuse)
-    grid.compute_neighbors_and_slopes()
+    grid = Grid(dem, flowdir, landuse, flowdir_encoding=flowdir_encoding, scratch_dir=scratch_dir)
+
+    # Without a flow direction raster the directions come from the filled DEM
+    if fill_sinks or flowdir is None:
+        grid.fill_depressions(derive_flowdir=flowdir is None, scratch_dir=scratch_dir)
+    grid.compute_neighbors_and_slopes(method=slope_method)
+    grid.route_by_flowdir()
 
+    # Cells without a downstream neighbor drain to the nearest junction
     if junctions:
         parsed_junctions = parse_junctions(junctions)
-        grid.route_to_junctions(parsed_junctions)
+        grid.mark_inlets(parsed_junctions)
+        grid.route_to_junctions(
+            parsed_junctions, unrouted_only=True,
+            landuse=junction_landuse, max_distance=junction_max_distance
+        )
 
 
+    grid.compute_flow_accumulation()
+
     if catchment_props:
         grid.set_catchment_properties(catchment_props)
 
-    cells = [cell for row in grid.cells for cell in row if cell is not None]
-
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     output_prefix = os.path.join(output_dir, f"model_{timestamp}")
 
+    # The dissolve gets the cell layers in process; writing them is optional
+    vector_dissolve = run_dissolve and dissolve_method in ("vector", "adaptive")
+    subcatchments = subcatchments_frame(grid) if vector_dissolve else grid
+    flowlines = flowlines_frame(grid) if vector_dissolve else grid
+    vector_ext = VECTOR_FORMATS[vector_format] if vector_format else None
+
     print("💾 Writing outputs...")
-    save_subcatchments_geojson(f"{output_prefix}_subcatchments.geojson", cells)
-    save_flowlines_geojson(f"{output_prefix}_routing.geojson", cells)
-    save_ascii_raster(f"{output_prefix}_elevation.asc", dem.array, dem.transform)
+    if vector_ext:
+        save_subcatchments(f"{output_prefix}_subcatchments{vector_ext}", subcatchments)
+        save_flowlines(f"{output_prefix}_routing{vector_ext}", flowlines)
+    if raster_format:
+        save_grid_rasters(grid, output_prefix, raster_format, precision=raster_precision)
 
-    save_swmm_inp(
-        f"{output_prefix}.inp", cells,
+    tables = dict(
         junctions=junctions,
         conduits=conduits,
         header=header,
@@ -78,6 +104,20 @@ def run_model(
         xsections=xsections
     )
 
+    def write_inp(path, cells):
+        # With a base model only the subcatchment sections (and any tables
+        # given) are regenerated; everything else is copied from it. The
+        # junction table then only locates the inlets.
+        if base_inp:
+            patch_swmm_inp(base_inp, path, cells, {
+                INP_TABLE_SECTIONS[key]: table for key, table in tables.items()
+                if table and key in INP_TABLE_SECTIONS and key != "junctions"
+            })
+        else:
+            save_swmm_inp(path, cells, **tables)
+
+    write_inp(f"{output_prefix}.inp", grid)
+
     # if run_dissolve:
     #     subcatchments_path = f"{output_prefix}_subcatchments.geojson"
     #     flowlines_path = f"{output_prefix}_routing.geojson"
@@ -92,67 +132,49 @@ def run_model(
     #     print("✅ Flow-aware subcatchment dissolve complete")
 
     if run_dissolve:
-        subcatchments_path = f"{output_prefix}_subcatchments.geojson"
-        flowlines_path = f"{output_prefix}_routing.geojson"
-        dissolved_path = f"{output_prefix}_dissolved.geojson"
-
-        # Step 1: Run flow-aware dissolve
-        dissolve_subcatchments_geojson(
-            subcatchment_file=subcatchments_path,
-            flowline_file=flowlines_path,
-            output_file=dissolved_path
-        )
-        print("✅ Flow-aware subcatchment dissolve complete")
-
-        # Step 2: Convert dissolved subcatchments to SWMM cells
-        print("🔄 Building final SWMM-ready cells from dissolved subcatchments...")
-        final_cells = merge_to_cells(dissolved_path, subcatchments_path)
+        dissolved_path = f"{output_prefix}_dissolved{vector_ext}" if vector_ext else None
+
+        if vector_dissolve:
+            # Step 1: Run flow-aware dissolve
+            if dissolve_method == "adaptive":
+                dissolved = adaptive_dissolve(
+                    subcatchments, flowlines, output_file=dissolved_path,
+                    max_count=max_subcatchments, min_area=min_subcatchment_area,
+                    max_area=max_subcatchment_area, max_slope_std=max_slope_std,
+                    priority=merge_priority, workers=dissolve_workers, tile=dissolve_tile)
+            else:
+                dissolved = dissolve_subcatchments(
+                    subcatchments, flowlines, output_file=dissolved_path,
+                    workers=dissolve_workers, tile=dissolve_tile)
+            print("✅ Flow-aware subcatchment dissolve complete")
+
+            # Step 2: Convert dissolved subcatchments to SWMM cells
+            print("🔄 Building final SWMM-ready cells from dissolved subcatchments...")
+            final_cells = merge_to_cells(dissolved, subcatchments, grid=grid)
+        else:
+            # Regions are labelled and polygonized on the grid, already one row per subcatchment
+            final_cells = dissolve_raster(grid, by=dissolve_method, output_file=dissolved_path)
+            print("✅ Raster-domain subcatchment dissolve complete")
 
         # Step 3: Write final .inp file with timestamp
         dissolved_inp_path = os.path.join(output_dir, f"swmm_dissolved_{timestamp}.inp")
-        save_swmm_inp(
-            dissolved_inp_path, final_cells,
-            junctions=junctions,
-            conduits=conduits,
-            header=header,
-            catchment_props=catchment_props,
-            evaporation=evaporation,
-            temperature=temperature,
-            inflows=inflows,
-            timeseries=timeseries,
-            report=report,
-            snowpacks=snowpacks,
-            raingages=raingages,
-            symbols=symbols,
-            outfalls=outfalls,
-            pumps=pumps,
-            pump_curves=pump_curves,
-            dwf=dwf,
-            patterns=patterns,
-            losses=losses,
-            storage=storage,
-            xsections=xsections
-        )
+        write_inp(dissolved_inp_path, final_cells)
         print(f"✅ Final SWMM .inp file with dissolved subcatchments saved as: {dissolved_inp_path}")
 
 
 def export_cells_as_shapefile(cells: List[Cell], crs: str) -> gpd.GeoDataFrame:
-    records = []
-    for i, c in enumerate(cells):
-        s = 0.5 * c.cell_size
-        geom = box(c.center_x - s, c.center_y - s, c.center_x + s, c.center_y + s)
-        records.append({
-            "id": i + 1,
-            "name": c.name,
-            "landuse": c.landuse,
-            "outlet": c.outlet,
-            "geometry": geom,
-            "area_m2": c.area,
-            "elevation": c.elevation,
-            "slope_pct": c.slope * 100,
-            "flowzone": 100 if c.landuse < 5 else 200
-        })
-    return gpd.GeoDataFrame(records, crs=crs)
+    frame = cells_to_frame(cells)
+    landuse = frame["landuse"].to_numpy()
+    return gpd.GeoDataFrame({
+        "id": np.arange(1, len(frame) + 1),
+        "name": frame["name"].to_numpy(),
+        "landuse": landuse,
+        "outlet": frame["outlet"].to_numpy(),
+        "area_m2": frame["area"].to_numpy(),
+        "elevation": frame["elevation"].to_numpy(),
+        "slope_pct": frame["slope"].to_numpy() * 100,
+        "flowzone": np.where(landuse < 5, 100, 200),
+    }, geometry=cell_polygons(frame), crs=crs)
 
 def finalize_swmm_from_dissolved(merged_gpkg: str, original_shp: str, output_inp: str):
     print("🔄 Merging dissolved geometries back into SWMM-ready cells...")
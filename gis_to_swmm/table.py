@@ -1,28 +1,107 @@
 # table.py
+import os
+import numpy as np
 import pandas as pd
+from gis_to_swmm.cache import cache_configured, cache_path, digest, publish
 from gis_to_swmm.definitions import Junction, Conduit
-from typing import List
+from typing import Dict, List, Optional
 
-def parse_junctions(junction_table):
-    junctions = []
-    nrows = junction_table.df.shape[0]
+# Column layout of the input tables that the model reads values from, as
+# (name, kind) by position. Header spellings differ between data sets, so
+# columns are matched by position and the names here are canonical.
+SCHEMAS = {
+    "junctions": [
+        ("x", "float"), ("y", "float"), ("name", "str"), ("max_depth", "float"),
+        ("invert", "float"), ("init_depth", "float"), ("open", "int"),
+    ],
+    "conduits": [
+        ("name", "str"), ("from_node", "str"), ("to_node", "str"),
+        ("length", "float"), ("roughness", "float"),
+    ],
+}
 
-    for i in range(1, nrows):  # Skip header if needed
-        x = float(junction_table.get(i, 0))
-        y = float(junction_table.get(i, 1))
-        name = junction_table.get(i, 2)
-        is_open = int(junction_table.get(i, 6)) == 1
-        invert = float(junction_table.get(i, 4))
-        junctions.append(Junction(name=name, x=x, y=y, is_open=is_open, invert_elev=invert))
-    
-    return junctions
+def read_csv_cached(path: str, use_cache: Optional[bool] = None) -> pd.DataFrame:
+    """
+    pd.read_csv with an on-disk cache of the parsed frame, keyed by the
+    absolute path, modification time and size of the file. The cache is
+    opt-in: by default it is used only when GIS_TO_SWMM_CACHE is set.
+    """
+    if use_cache is None:
+        use_cache = cache_configured()
+    if not use_cache:
+        return pd.read_csv(path)
 
-def load_table(path):
-    return Table(path)
+    stat = os.stat(path)
+    cached = cache_path("tables", digest(os.path.abspath(path), stat.st_mtime_ns, stat.st_size), ".pkl")
+    if os.path.exists(cached):
+        return pd.read_pickle(cached)
+
+    df = pd.read_csv(path)
+    tmp = cached + ".tmp"
+    df.to_pickle(tmp, compression=None)
+    publish(tmp, cached)
+    return df
+
+def _coerce(column: pd.Series, kind: str) -> pd.Series:
+    if kind == "str":
+        return column.where(column.isna(), column.astype(str))
+    values = pd.to_numeric(column, errors="coerce")
+    if kind == "int" and not values.isna().any():
+        return values.astype(np.int64)
+    return values.astype(float)
+
+def write_rows(stream, df: pd.DataFrame, na_rep: str = "nan"):
+    """
+    Write the rows of df tab-separated, every value as its str(). Nothing
+    is quoted or escaped, so paths and quoted names pass through verbatim.
+    """
+    values = df.astype(object).where(df.notna(), na_rep)
+    stream.writelines("\t".join(map(str, row)) + "\n" for row in values.itertuples(index=False, name=None))
+
+def junction_arrays(junction_table) -> Dict[str, np.ndarray]:
+    """
+    Junction columns as arrays: x, y, name, invert and is_open. Rows
+    without numeric coordinates or a name (e.g. a repeated header line)
+    are dropped.
+    """
+    df = junction_table.typed("junctions")
+    df = df.dropna(subset=["x", "y", "name"])
+    is_open = df["open"] == 1 if "open" in df else pd.Series(True, index=df.index)
+    invert = df["invert"].fillna(0.0) if "invert" in df else pd.Series(0.0, index=df.index)
+    return {
+        "x": df["x"].to_numpy(dtype=float),
+        "y": df["y"].to_numpy(dtype=float),
+        "name": df["name"].to_numpy(dtype=object),
+        "invert": invert.to_numpy(dtype=float),
+        "is_open": is_open.to_numpy(dtype=bool),
+    }
+
+def parse_junctions(junction_table) -> List[Junction]:
+    a = junction_arrays(junction_table)
+    return [
+        Junction(name=name, x=x, y=y, is_open=is_open, invert_elev=invert)
+        for name, x, y, is_open, invert in zip(
+            a["name"].tolist(), a["x"].tolist(), a["y"].tolist(), a["is_open"].tolist(), a["invert"].tolist()
+        )
+    ]
+
+def parse_conduits(conduit_table) -> List[Conduit]:
+    df = conduit_table.typed("conduits").dropna(subset=["name", "from_node", "to_node"])
+    return [
+        Conduit(*row)
+        for row in zip(*(df[c].tolist() for c in ("name", "from_node", "to_node", "length", "roughness")))
+    ]
+
+def load_table(path, section: Optional[str] = None, use_cache: Optional[bool] = None):
+    return Table(path, section=section, use_cache=use_cache)
 
 class Table:
-    def __init__(self, path: str):
-        self.df = pd.read_csv(path)
+    def __init__(self, path: Optional[str] = None, section: Optional[str] = None, use_cache: Optional[bool] = None):
+        self.section = section
+        self.df = read_csv_cached(path, use_cache) if path else pd.DataFrame()
+
+    def load(self, path: str, use_cache: Optional[bool] = None):
+        self.df = read_csv_cached(path, use_cache)
 
     def get(self, row: int, col: int):
         return self.df.iloc[row, col]
@@ -36,28 +115,26 @@ class Table:
     def print(self):
         print(self.df)
 
+    def typed(self, section: Optional[str] = None) -> pd.DataFrame:
+        """
+        The table's leading columns renamed and converted after the schema of
+        section (by default the section it was loaded as). Values that do
+        not parse become NaN; columns past the schema are dropped.
+        """
+        schema = SCHEMAS[section or self.section]
+        ncols = min(len(schema), self.df.shape[1])
+        return pd.DataFrame({
+            name: _coerce(self.df.iloc[:, i], kind) for i, (name, kind) in enumerate(schema[:ncols])
+        })
+
+    @staticmethod
     def load_junctions(path) -> List[Junction]:
-        df = pd.read_csv(path)
-        return [
-            Junction(row['name'], row['x'], row['y'], row['is_open'], row['invert'])
-            for _, row in df.iterrows()
-        ]
+        return parse_junctions(load_table(path, "junctions"))
 
+    @staticmethod
     def load_conduits(path) -> List[Conduit]:
-        df = pd.read_csv(path)
-        return [
-            Conduit(row['name'], row['from_node'], row['to_node'], row['length'], row['roughness'])
-            for _, row in df.iterrows()
-        ]
-    
-    def write_to_stream(self, stream):
-        # Write headers
-        stream.write("\t".join(self.df.columns) + "\n")
-        
-        for _, row in self.df.iterrows():
-            line = "\t".join(str(val) for val in row)
-            stream.write(line + "\n")
-
-
-
+        return parse_conduits(load_table(path, "conduits"))
 
+    def write_to_stream(self, stream):
+        stream.write("\t".join(map(str, self.df.columns)) + "\n")
+        write_rows(stream, self.df)
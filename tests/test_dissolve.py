@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from gis_to_swmm.definitions import D8_OFFSETS
+from gis_to_swmm.dissolve import adaptive_dissolve, dissolve_subcatchments
+from gis_to_swmm.merge import merge_to_cells
+
+BASELINE = os.path.join(os.path.dirname(__file__), "data", "dissolve_baseline.csv")
+CELL = 2.0
+
+
+def cell_layers(nrows=8, ncols=10):
+    """
+    Square cell and flowline layers shaped like subcatchments_frame and
+    flowlines_frame: cells drain to their steepest lower neighbor, cells
+    without one to junction j1 (west half) or j2 (east half).
+    """
+    rows, cols = np.indices((nrows, ncols))
+    elevation = 50 - 0.3 * rows - 0.1 * cols + ((rows * 7 + cols * 3) % 5) * 0.05
+    landuse = np.where(cols < 4, 10, np.where(cols < 7, 30, 60))
+    landuse[5:, 2:5] = 60
+    names = np.char.add(np.char.add("s", rows.astype(str)), np.char.add("_", cols.astype(str)))
+
+    outlet = np.where(cols < ncols // 2, "j1", "j2").astype(object)
+    slope = np.zeros((nrows, ncols))
+    for r in range(nrows):
+        for c in range(ncols):
+            for dr, dc in D8_OFFSETS:
+                r2, c2 = r + dr, c + dc
+                if 0 <= r2 < nrows and 0 <= c2 < ncols:
+                    drop = (elevation[r, c] - elevation[r2, c2]) / (CELL * np.hypot(dr, dc))
+                    if drop > slope[r, c]:
+                        slope[r, c], outlet[r, c] = drop, names[r2, c2]
+
+    x0, y0 = cols.ravel() * CELL, -rows.ravel() * CELL
+    subcatchments = gpd.GeoDataFrame({
+        "id": np.arange(1, rows.size + 1),
+        "name": names.ravel().astype(object),
+        "outlet": outlet.ravel(),
+        "area_m2": np.full(rows.size, CELL ** 2),
+        "slope_pct": slope.ravel() * 100,
+        "elevation": elevation.ravel(),
+        "landuse": landuse.ravel(),
+    }, geometry=shapely.box(x0, y0 - CELL, x0 + CELL, y0), crs=3067)
+
+    centers = dict(zip(subcatchments["name"], shapely.centroid(subcatchments.geometry.to_numpy())))
+    routed = subcatchments[subcatchments["outlet"].isin(set(centers))]
+    flowlines = gpd.GeoDataFrame({
+        "from": routed["name"].to_numpy(),
+        "to": routed["outlet"].to_numpy(),
+    }, geometry=[shapely.LineString([centers[a], centers[b]]) for a, b in zip(routed["name"], routed["outlet"])],
+        crs=3067)
+    return subcatchments, flowlines
+
+
+def test_vector_dissolve_matches_baseline():
+    # Recorded with the original pairwise-merge dissolve on the same layers
+    expected = pd.read_csv(BASELINE)
+    subcatchments, flowlines = cell_layers()
+
+    for union in ("auto", "unary"):
+        dissolved = dissolve_subcatchments(subcatchments, flowlines, union=union)
+        assert dissolved["outlet"].tolist() == expected["outlet"].tolist()
+        assert dissolved["landuse"].tolist() == expected["landuse"].tolist()
+        for column in ("area_m2", "slope_pct", "elevation"):
+            assert np.allclose(dissolved[column], expected[column])
+        assert shapely.equals(dissolved.geometry.to_numpy(), shapely.from_wkt(expected["wkt"].to_numpy())).all()
+
+
+def test_adaptive_dissolve_routes_between_final_subcatchments(capsys):
+    subcatchments, flowlines = cell_layers()
+    dissolved = adaptive_dissolve(subcatchments, flowlines, max_count=25)
+    assert len(dissolved) == 25
+    assert np.isclose(dissolved["area_m2"].sum(), subcatchments["area_m2"].sum())
+    assert "⚠️" not in capsys.readouterr().out
+
+    # Landuse boundaries stop merging short of 12
+    assert len(adaptive_dissolve(subcatchments, flowlines, max_count=12)) > 12
+    assert "⚠️ No further merges allowed" in capsys.readouterr().out
+
+    cells = merge_to_cells(dissolved, subcatchments)
+    assert len(cells) == len(dissolved)
+    assert set(cells["outlet"]) <= set(cells["name"]) | {"j1", "j2"}
@@ -0,0 +1,198 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from rasterio.coords import BoundingBox
+from rasterio.transform import from_origin
+
+from gis_to_swmm.definitions import D8_OFFSETS, FLOWDIR_ENCODINGS, LAYER_PARAM_COLUMNS, Junction
+from gis_to_swmm.dissolve import dissolve_raster
+from gis_to_swmm.grid import Grid, compile_landuse_params, default_landuse_params, nearest_junctions
+from gis_to_swmm.io_utils import save_subcatchments, subcatchments_frame
+from gis_to_swmm.merge import merge_to_cells
+from gis_to_swmm.raster import Raster
+
+
+def test_compile_landuse_params_treats_negative_codes_as_unknown():
+    table = pd.DataFrame({"imperv": [99.0, 10.0, 20.0]}, index=pd.Index([-1, 3, 5], name="landuse"))
+    lut, values = compile_landuse_params(table)
+
+    default = float(default_landuse_params()["imperv"])
+    assert lut.size == 6
+    assert values["imperv"][lut[[0, 3, 4, 5]]].tolist() == [default, 10.0, default, 20.0]
+    # Code -1 must not land on the last entry of the lookup table
+    assert 99.0 not in values["imperv"][lut].tolist()
+
+
+def make_raster(array, nodata, cellsize=2.0):
+    transform = from_origin(500000.0, 6700000.0, cellsize, cellsize)
+    height, width = array.shape
+    return Raster(
+        array=array, transform=transform, crs="EPSG:3067", nodata=nodata,
+        width=width, height=height, resolution=cellsize,
+        bounds=BoundingBox(transform.c, transform.f - height * cellsize, transform.c + width * cellsize, transform.f),
+    )
+
+
+def test_d8_slopes_match_brute_force():
+    rng = np.random.default_rng(7)
+    elevation = rng.random((9, 11)).astype(np.float32) * 5
+    elevation[4, 3:6] = -9999
+    landuse = np.full(elevation.shape, 30, dtype=np.uint8)
+    grid = Grid(make_raster(elevation, -9999), None, make_raster(landuse, 255))
+    grid.compute_neighbors_and_slopes(method="d8")
+
+    nrows, ncols = elevation.shape
+    for r in range(nrows):
+        for c in range(ncols):
+            best, target = 0.0, -1
+            if elevation[r, c] != -9999:
+                for dr, dc in D8_OFFSETS:
+                    r2, c2 = r + dr, c + dc
+                    if 0 <= r2 < nrows and 0 <= c2 < ncols and elevation[r2, c2] != -9999:
+                        drop = (float(elevation[r, c]) - float(elevation[r2, c2])) / (2.0 * np.hypot(dr, dc))
+                        if drop > best:
+                            best, target = drop, r2 * ncols + c2
+            assert np.isclose(grid.slope[r, c], best, rtol=1e-6)
+            assert grid.downslope_index[r, c] == target
+
+
+def test_flow_cycles_are_cut_at_their_lowest_cell(capsys):
+    # Everything drains east out of the grid, except for a 2-cell cycle in the middle
+    elevation = np.full((5, 5), 10.0, dtype=np.float32)
+    elevation[2, 2] = 9.0
+    flowdir = np.full((5, 5), 8, dtype=np.int16)
+    flowdir[2, 2] = 4
+    landuse = np.full((5, 5), 30, dtype=np.uint8)
+    grid = Grid(make_raster(elevation, -9999), make_raster(flowdir, -1), make_raster(landuse, 255))
+
+    grid.route_by_flowdir()
+    assert "1 cycles" in capsys.readouterr().out
+    assert grid.downstream[2, 2] == -1
+    assert grid.downstream[2, 1] == 2 * 5 + 2
+    assert grid.is_sink[2, 2] == 1
+
+    grid.compute_flow_accumulation()
+    assert not np.isnan(grid.contributing_area).any()
+    assert grid.contributing_area[2, 2] == 3 * 4.0
+
+    labels = grid.region_labels("flow")
+    assert (labels >= 0).all()
+    frame = grid.region_frame(labels)
+    assert frame["area"].sum() == 100.0
+
+
+def test_landuse_params_survive_a_subcatchment_file(tmp_path):
+    elevation = np.add.outer(np.arange(6.0, 0, -1), np.arange(6.0, 0, -1)).astype(np.float32)
+    landuse = np.where(np.arange(6) < 3, 30, 60)[None, :].repeat(6, axis=0).astype(np.uint8)
+    grid = Grid(make_raster(elevation, -9999), None, make_raster(landuse, 255))
+    props = pd.DataFrame([
+        [30, 70.0, 0.05, 0.014, 0.1, 0.2, 25.0, "r1", 0.4, 0.25, 3.2],
+        [60, 5.0, 0.05, 0.013, 0.1, 0.4, 25.0, "r1", 1.0, 0.3, 4.0],
+    ])
+    grid.set_catchment_properties(SimpleNamespace(df=props))
+    grid.fill_depressions(derive_flowdir=True)
+    grid.compute_neighbors_and_slopes()
+    grid.route_by_flowdir()
+
+    path = tmp_path / "cells.gpkg"
+    save_subcatchments(path, grid)
+    merged = dissolve_raster(grid)
+    from_file = merge_to_cells(merged, path)
+    in_process = merge_to_cells(merged, subcatchments_frame(grid), grid=grid)
+
+    keys = list(LAYER_PARAM_COLUMNS.values())
+    assert sorted(from_file["imperv"].unique()) == [5.0, 70.0]
+    pd.testing.assert_frame_equal(from_file[keys], in_process[keys], check_dtype=False)
+
+
+@pytest.mark.parametrize("encoding,code,offset", [
+    (encoding, code, offset)
+    for encoding, table in FLOWDIR_ENCODINGS.items()
+    for code, offset in table.items()
+])
+def test_flowdir_codes_route_to_their_neighbor(encoding, code, offset):
+    assert D8_OFFSETS[Grid.decode_flowdir(np.array([code]), encoding)[0]] == offset
+
+    # The center of a 3x3 grid drains to the neighbor the code points at
+    flowdir = np.full((3, 3), -1, dtype=np.int16)
+    flowdir[1, 1] = code
+    grid = Grid(
+        make_raster(np.ones((3, 3), dtype=np.float32), -9999), make_raster(flowdir, -1),
+        make_raster(np.full((3, 3), 30, dtype=np.uint8), 255), flowdir_encoding=encoding,
+    )
+    grid.route_by_flowdir()
+    assert grid.downstream[1, 1] == (1 + offset[0]) * 3 + 1 + offset[1]
+    assert grid.encode_flowdir(grid.flow_direction, encoding)[1, 1] == code
+
+
+@pytest.mark.parametrize("encoding,codes", [
+    ("grass", [0, 9, -1, 255]),
+    ("taudem", [0, 9, -8, 32767]),
+    ("esri", [0, 3, 5, 6, 7, 9, 127, 129, 255, -1]),
+])
+def test_invalid_flowdir_codes_are_not_routed(encoding, codes):
+    codes = np.array(codes, dtype=np.int16)
+    assert (Grid.decode_flowdir(codes, encoding) == -1).all()
+
+    flowdir = codes[None, :]
+    grid = Grid(
+        make_raster(np.ones(flowdir.shape, dtype=np.float32), -9999), make_raster(flowdir, -32768),
+        make_raster(np.full(flowdir.shape, 30, dtype=np.uint8), 255), flowdir_encoding=encoding,
+    )
+    grid.route_by_flowdir()
+    assert (grid.downstream == -1).all()
+    assert (grid.is_sink == 1).all()
+
+
+def test_nearest_junctions_ties_limits_and_closed_junctions(monkeypatch):
+    # Junctions 1 and 2 are equidistant from (5, 0); 0 is closed but nearest to the origin
+    junctions = [
+        Junction("closed", 0.0, 0.0, is_open=False),
+        Junction("left", 3.0, 0.0),
+        Junction("right", 7.0, 0.0),
+        Junction("far", 100.0, 0.0),
+    ]
+    x = np.array([5.0, 0.0, 99.0, 50.0, 5.0])
+    y = np.array([0.0, 0.0, 0.0, 0.0, 3.0])
+
+    index, distance = nearest_junctions(junctions, x, y)
+    assert index.tolist() == [1, 1, 3, 2, 1]
+    assert np.allclose(distance, [2.0, 3.0, 1.0, 43.0, np.hypot(2.0, 3.0)])
+
+    index, distance = nearest_junctions(junctions, x, y, max_distance=10.0)
+    assert index.tolist() == [1, 1, 3, -1, 1]
+    assert distance[3] == np.inf
+
+    # Ties also resolve to the lowest index when points span several query chunks
+    monkeypatch.setattr("gis_to_swmm.grid.JUNCTION_QUERY_CHUNK", 2)
+    assert nearest_junctions(junctions, x, y)[0].tolist() == [1, 1, 3, 2, 1]
+
+    index, distance = nearest_junctions([junctions[0]], x, y)
+    assert (index == -1).all() and np.isinf(distance).all()
+
+
+def test_flow_accumulation_matches_brute_force():
+    rng = np.random.default_rng(11)
+    elevation = rng.random((7, 9)).astype(np.float32) * 4
+    elevation[3, 4] = -9999
+    landuse = np.full(elevation.shape, 30, dtype=np.uint8)
+    landuse[0, :3] = 0
+    grid = Grid(make_raster(elevation, -9999), None, make_raster(landuse, 255))
+    grid.fill_depressions(derive_flowdir=True)
+    grid.route_by_flowdir()
+    grid.compute_flow_accumulation()
+
+    downstream = grid.downstream.ravel()
+    active = grid.active.mask.ravel()
+    expected = np.zeros(downstream.size)
+    for cell in np.flatnonzero(active):
+        node = cell
+        while node >= 0:
+            expected[node] += 4.0
+            node = downstream[node]
+    area = grid.contributing_area.ravel()
+    assert np.array_equal(area[active], expected[active])
+    assert np.isnan(area[~active]).all()
+    assert (grid.watershed.ravel()[~active] == -1).all()
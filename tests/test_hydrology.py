@@ -0,0 +1,117 @@
+import numpy as np
+
+from gis_to_swmm import hydrology
+from gis_to_swmm.definitions import D8_OFFSETS
+
+
+def downstream_of(direction):
+    nrows, ncols = direction.shape
+    rows, cols = np.indices(direction.shape)
+    offsets = np.array(D8_OFFSETS)[direction.ravel()]
+    target = (rows.ravel() + offsets[:, 0]) * ncols + cols.ravel() + offsets[:, 1]
+    return np.where(direction.ravel() >= 0, target, -1)
+
+
+def test_priority_flood_drains_high_edges_into_the_grid():
+    # A plane falling from row 0 to the last row, with a pit in the middle
+    elevation = np.repeat(np.arange(12, 0, -1, dtype=float)[:, None], 9, axis=1)
+    elevation[6, 4] = -5.0
+    valid = np.ones(elevation.shape, dtype=bool)
+
+    filled, direction = hydrology.priority_flood(elevation, valid)
+
+    # Only the bottom row has nowhere lower to go
+    outlets = np.argwhere(direction < 0)
+    assert set(outlets[:, 0]) == {11}
+    assert len(outlets) == 9
+    # High edge cells drain downhill, not out of the grid
+    assert D8_OFFSETS[direction[0, 0]][0] == 1
+    assert D8_OFFSETS[direction[0, 4]] == (1, 0)
+    # The pit is raised just above its spill level and everything drains
+    assert filled[6, 4] > elevation[7, 4]
+    downstream = downstream_of(direction)
+    levels = hydrology.topological_levels(downstream)
+    assert sum(level.size for level in levels) == elevation.size
+    area = hydrology.accumulate(downstream, levels, np.ones(elevation.size))
+    assert area[downstream < 0].sum() == elevation.size
+
+
+def test_priority_flood_keeps_nodata_neighbors_draining():
+    elevation = np.add.outer(np.arange(8.0), np.arange(8.0))
+    valid = np.ones(elevation.shape, dtype=bool)
+    valid[3:5, 3:5] = False
+
+    filled, direction = hydrology.priority_flood(elevation, valid)
+
+    # Cells around the hole are seeds but still have lower neighbors
+    assert (direction[valid] >= 0).sum() == valid.sum() - 1
+    assert direction[0, 0] == -1
+    assert np.array_equal(filled[valid], elevation[valid])
+
+
+def test_priority_flood_spilled_queue_matches_unbounded():
+    rng = np.random.default_rng(0)
+    elevation = rng.normal(size=(40, 50)).astype(np.float32)
+    elevation[5, 5] = -0.0
+    valid = np.ones(elevation.shape, dtype=bool)
+    valid[10:14, 20:30] = False
+
+    filled, direction = hydrology.priority_flood(elevation, valid)
+    small_filled, small_direction = hydrology.priority_flood(elevation, valid, max_queue=16)
+
+    assert filled.dtype == np.float32
+    assert np.array_equal(filled, small_filled)
+    assert np.array_equal(direction, small_direction)
+    # No cell sits below the spill level that drains it
+    assert (filled[valid] >= elevation[valid]).all()
+
+
+def test_cycle_outlets_picks_the_lowest_cell_of_each_cycle():
+    # 0 -> 1 -> 0 is a 2-cell cycle fed by 2; 3 -> 4 -> 5 -> 3 a 3-cell one; 6 drains out
+    downstream = np.array([1, 0, 0, 4, 5, 3, -1])
+    key = np.array([5.0, 5.0, 9.0, 3.0, 1.0, 2.0, 0.0])
+    levels = hydrology.topological_levels(downstream)
+
+    assert hydrology.cycle_outlets(downstream, levels).tolist() == [0, 3]
+    cut = hydrology.cycle_outlets(downstream, levels, key)
+    assert cut.tolist() == [0, 4]
+
+    downstream[cut] = -1
+    levels = hydrology.topological_levels(downstream)
+    assert sum(level.size for level in levels) == downstream.size
+    assert hydrology.cycle_outlets(downstream, levels).size == 0
+
+
+def test_level_passes_match_walking_each_flow_path():
+    # A random forest: every cell drains to a higher index or nowhere
+    rng = np.random.default_rng(3)
+    n = 300
+    downstream = np.where(rng.random(n) < 0.1, -1, np.minimum(np.arange(n) + rng.integers(1, 20, n), n))
+    downstream[downstream >= n] = -1
+    weights = rng.random(n)
+    step = rng.random(n) + 0.5
+    target = rng.random(n) < 0.05
+    levels = hydrology.topological_levels(downstream)
+
+    area = hydrology.accumulate(downstream, levels, weights)
+    length = hydrology.distance_to_target(downstream, levels, step, target)
+    label = hydrology.watershed_labels(downstream, levels, np.ones(n, dtype=bool))
+
+    expected_area = np.zeros(n)
+    outlets = np.flatnonzero(downstream < 0).tolist()
+    for cell in range(n):
+        walked, node = 0.0, cell
+        reached = False
+        while True:
+            expected_area[node] += weights[cell]
+            if target[node] and not reached:
+                assert np.isclose(length[cell], walked)
+                reached = True
+            if downstream[node] < 0:
+                break
+            if not reached:
+                walked += step[node]
+            node = downstream[node]
+        assert reached or np.isnan(length[cell])
+        assert label[cell] == outlets.index(node)
+    assert np.allclose(area, expected_area)
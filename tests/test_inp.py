@@ -0,0 +1,71 @@
+import pandas as pd
+
+from gis_to_swmm.io_utils import InpFile, patch_swmm_inp, save_swmm_inp
+
+HAND_EDITED = """[OPTIONS]
+;;Option             Value
+FLOW_UNITS           LPS
+START_DATE           06/01/2024
+
+[JUNCTIONS]
+;;Name   Invert   MaxDepth   InitDepth   SurDepth   Aponded
+j1       38.5     2.0        0          0          0
+j2       37.0     2.0        0          0          0   ; hand-edited
+
+[COORDINATES]
+j1       500010   6699950
+j2       500050   6699970
+
+[END]
+"""
+
+
+def subcatchments(outlet="j1", imperv=25.0):
+    return pd.DataFrame({
+        "name": ["s0_0", "s0_1", "s1_0"], "raingage": "r1", "outlet": ["s0_1", outlet, outlet],
+        "area": 4.0, "imperv": imperv, "flow_width": 1.4, "slope": [0.01, 0.02, 0.03], "cell_size": 2.0,
+        "snow_pack": "", "landuse": 30, "N_Imperv": 0.015, "N_Perv": 0.3, "S_Imperv": 0.05,
+        "S_Perv": 0.1, "PctZero": 25.0, "RouteTo": "OUTLET", "PctRouted": 100.0,
+        "Suction": 4.0, "HydCon": 1.0, "IMDmax": 0.3,
+    })
+
+
+def base_model(tmp_path):
+    generated = tmp_path / "generated.inp"
+    save_swmm_inp(generated, subcatchments())
+    text = generated.read_text()
+    base = tmp_path / "base.inp"
+    base.write_text(text.replace("[END]\n", "") + HAND_EDITED)
+    return base
+
+
+def test_patch_with_the_same_cells_is_byte_identical(tmp_path):
+    base = base_model(tmp_path)
+    out = tmp_path / "patched.inp"
+
+    InpFile(str(base)).rewrite(str(out), {})
+    assert out.read_bytes() == base.read_bytes()
+
+    patch_swmm_inp(str(base), str(out), subcatchments())
+    assert out.read_bytes() == base.read_bytes()
+
+
+def test_patch_replaces_only_subcatchment_sections(tmp_path):
+    base = base_model(tmp_path)
+    out = tmp_path / "patched.inp"
+    patch_swmm_inp(str(base), str(out), subcatchments(outlet="j2", imperv=60.0), {"TAGS": "Node j1 inlet\n\n"})
+
+    before, after = InpFile(str(base)), InpFile(str(out))
+    assert after.sections == before.sections[:-1] + ["TAGS", "END"]
+    for name in ("OPTIONS", "JUNCTIONS", "COORDINATES"):
+        assert after.read_section(name) == before.read_section(name)
+    assert after.read_section("TAGS") == b"Node j1 inlet\n\n"
+
+    rows = after["SUBCATCHMENTS"].df
+    assert rows.iloc[:, 2].tolist() == ["s0_1", "j2", "j2"]
+    assert pd.to_numeric(rows.iloc[:, 4]).tolist() == [60.0, 60.0, 60.0]
+    assert after.read_section("SUBAREAS") == before.read_section("SUBAREAS")
+
+    # Patching the patched file in place round-trips back to the base
+    patch_swmm_inp(str(out), str(out), subcatchments(), {})
+    assert InpFile(str(out)).read_section("SUBCATCHMENTS") == before.read_section("SUBCATCHMENTS")
@@ -0,0 +1,96 @@
+import numpy as np
+import geopandas as gpd
+import pyogrio
+import pytest
+import rasterio
+import shapely
+from rasterio.transform import Affine, from_origin
+
+from gis_to_swmm.io_utils import read_layer, save_ascii_raster, stream_layer, write_layer
+
+
+def squares(start, n, crs=3067):
+    x = np.arange(start, start + n)
+    return gpd.GeoDataFrame(
+        {"id": x, "name": [f"s{v}" for v in x]},
+        geometry=shapely.box(x, 0, x + 1, 1), crs=crs,
+    )
+
+
+@pytest.mark.parametrize("ext", [".gpkg", ".fgb"])
+def test_stream_layer_joins_chunks_into_several_batches(tmp_path, ext):
+    # Chunks of 7 regrouped into batches of 5 join frames across chunk borders
+    path = tmp_path / f"cells{ext}"
+    stream_layer(path, iter([squares(0, 7), squares(7, 7), squares(14, 7)]), batch_rows=5)
+
+    layer = read_layer(path).sort_values("id")
+    assert layer["id"].tolist() == list(range(21))
+    assert layer["name"].tolist() == [f"s{v}" for v in range(21)]
+    assert np.allclose(layer.geometry.bounds["minx"], np.arange(21))
+
+
+@pytest.mark.parametrize("ext", [".gpkg", ".fgb"])
+def test_stream_layer_falls_back_to_fiona_before_gdal_3_8(tmp_path, ext, monkeypatch):
+    monkeypatch.setattr(pyogrio, "__gdal_version__", (3, 6, 4))
+    monkeypatch.setattr(pyogrio, "write_arrow", pytest.fail)
+    gdf = squares(7, 7)
+    gdf.loc[6, "geometry"] = shapely.MultiPolygon([shapely.box(13, 0, 14, 1), shapely.box(13, 2, 14, 3)])
+    path = tmp_path / f"cells{ext}"
+    stream_layer(path, iter([squares(0, 7), gdf]), batch_rows=5, geometry_type="MultiPolygon")
+
+    assert pyogrio.read_info(path)["geometry_type"] == "MultiPolygon"
+    layer = read_layer(path).sort_values("id")
+    assert layer["name"].tolist() == [f"s{v}" for v in range(14)]
+    assert np.allclose(layer.area, [1.0] * 13 + [2.0])
+
+
+@pytest.mark.parametrize("ext", [".gpkg", ".fgb"])
+def test_write_layer_declares_mixed_polygons_multi(tmp_path, ext):
+    gdf = squares(0, 12)
+    gdf.loc[11, "geometry"] = shapely.MultiPolygon([shapely.box(0, 5, 1, 6), shapely.box(0, 7, 1, 8)])
+    path = tmp_path / f"dissolved{ext}"
+    stream_layer(path, iter([gdf]), batch_rows=5, geometry_type="MultiPolygon")
+    write_layer(tmp_path / f"whole{ext}", gdf)
+
+    for written in (path, tmp_path / f"whole{ext}"):
+        assert pyogrio.read_info(written)["geometry_type"] == "MultiPolygon"
+        layer = read_layer(written).sort_values("id")
+        assert len(layer) == 12
+        assert np.allclose(layer.area, [1.0] * 11 + [2.0])
+
+
+def test_ascii_raster_header_matches_the_transform(tmp_path):
+    transform = from_origin(500010.5, 6700040.0, 2.0, 2.0)
+    array = np.arange(20, dtype=float).reshape(5, 4) / 3
+    array[1, 2] = np.nan
+    path = tmp_path / "grid.asc"
+    save_ascii_raster(path, array, transform, precision=2, chunk_rows=2)
+
+    lines = path.read_text().splitlines()
+    header = dict(line.split() for line in lines[:6])
+    assert header == {
+        "ncols": "4", "nrows": "5", "xllcorner": "500010.5", "yllcorner": "6700030.0",
+        "cellsize": "2.0", "NODATA_value": "-9999",
+    }
+    assert lines[6] == "0.00 0.33 0.67 1.00"
+    assert lines[7].split()[2] == "-9999.00"
+    assert len(lines) == 6 + 5
+
+    with rasterio.open(path) as src:
+        assert src.transform.almost_equals(transform)
+        read = src.read(1, masked=True)
+    assert read.mask[1, 2]
+    assert np.allclose(read.filled(np.nan), array, atol=0.005, equal_nan=True)
+
+
+def test_ascii_raster_writes_integers_and_rectangular_cells(tmp_path):
+    transform = from_origin(0.0, 100.0, 2.0, 5.0)
+    path = tmp_path / "codes.asc"
+    save_ascii_raster(path, np.array([[1, -1], [30, 60]], dtype=np.int16), transform, nodata=-1)
+
+    lines = path.read_text().splitlines()
+    assert lines[2:6] == ["xllcorner     0.0", "yllcorner     90.0", "dx            2.0", "dy            5.0"]
+    assert lines[7:] == ["1 -1", "30 60"]
+
+    with pytest.raises(ValueError):
+        save_ascii_raster(tmp_path / "rotated.asc", np.zeros((2, 2)), transform * Affine.rotation(10))
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from gis_to_swmm import cache
+from gis_to_swmm.raster import Raster, resample_to
+
+
+def write_tif(path, array, cellsize):
+    transform = from_origin(500000.0, 6700000.0, cellsize, cellsize)
+    with rasterio.open(
+        path, "w", driver="GTiff", height=array.shape[0], width=array.shape[1], count=1,
+        dtype=array.dtype, crs="EPSG:3067", transform=transform, nodata=255,
+    ) as dst:
+        dst.write(array, 1)
+
+
+def layers(tmp_path):
+    write_tif(tmp_path / "dem.tif", np.zeros((8, 8), dtype=np.uint8), 1.0)
+    write_tif(tmp_path / "landuse.tif", np.arange(16, dtype=np.uint8).reshape(4, 4), 2.0)
+    return Raster.from_file(str(tmp_path / "dem.tif")), str(tmp_path / "landuse.tif")
+
+
+def test_resample_cache_is_off_without_the_env_var(tmp_path, monkeypatch):
+    monkeypatch.delenv(cache.CACHE_ENV, raising=False)
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    dem, landuse = layers(tmp_path)
+
+    aligned = resample_to(landuse, dem)
+
+    assert aligned.array[2:4, 0:2].tolist() == [[4, 4], [4, 4]]
+    assert not os.path.exists(tmp_path / "home")
+
+
+def test_resample_cache_hashes_an_unchanged_source_once(tmp_path, monkeypatch):
+    monkeypatch.setenv(cache.CACHE_ENV, str(tmp_path / "cache"))
+    dem, landuse = layers(tmp_path)
+    hashed = []
+    file_digest = cache.file_digest
+    monkeypatch.setattr(cache, "file_digest", lambda path: hashed.append(path) or file_digest(path))
+
+    first = resample_to(landuse, dem)
+    again = resample_to(landuse, dem)
+
+    assert hashed == [landuse]
+    assert np.array_equal(first.array, again.array)
+    assert os.listdir(tmp_path / "cache" / "aligned")
@@ -0,0 +1,39 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from gis_to_swmm.io_utils import InpFile
+from gis_to_swmm.table import Table, load_table
+
+TIMESERIES = 'name,file\nrain1,"""C:\\data\\rain.dat"""\nrain2,D:\\gauges\\r2.dat\n'
+
+
+def test_tables_write_paths_verbatim(tmp_path):
+    path = tmp_path / "timeseries.csv"
+    path.write_text(TIMESERIES)
+    stream = io.StringIO()
+    load_table(str(path)).write_to_stream(stream)
+    assert stream.getvalue() == 'name\tfile\nrain1\t"C:\\data\\rain.dat"\nrain2\tD:\\gauges\\r2.dat\n'
+
+
+def test_edited_inp_section_writes_paths_verbatim(tmp_path):
+    path = tmp_path / "model.inp"
+    path.write_text("[TIMESERIES]\n;;Name\tFile\nrain1\tFILE\t\"C:\\old\\rain.dat\"\n\n[END]\n")
+    section = InpFile(str(path))["TIMESERIES"]
+    df = section.df.copy()
+    df.iloc[0, 2] = '"C:\\data\\rain.dat"'
+    section.df = df
+
+    stream = io.StringIO()
+    section.write_to_stream(stream)
+    assert stream.getvalue().splitlines()[-1] == 'rain1\tFILE\t"C:\\data\\rain.dat"'
+
+
+def test_typed_float_columns_are_float():
+    table = Table()
+    table.section = "conduits"
+    table.df = pd.DataFrame({"name": ["c1"], "from": ["j1"], "to": ["j2"], "length": [10], "roughness": [0.013]})
+    typed = table.typed()
+    assert typed["length"].dtype == np.float64
+    assert typed["length"].tolist() == [10.0]